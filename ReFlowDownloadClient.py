@@ -2,15 +2,59 @@ import Tkinter
 import ttk
 import tkMessageBox
 import tkFileDialog
+import tkSimpleDialog
 from PIL import Image, ImageTk
 import re
 import sys
 import os
+import stat
+import errno
 import json
 import hashlib
-
+import multiprocessing
+import threading
+import Queue
+import collections
+import zlib
+import tarfile
+import zipfile
+import csv
+import StringIO
+import time
+import tempfile
+import traceback
+import bisect
+import heapq
+import random
+import ctypes
+import ctypes.util
+
+import requests
 import reflowrestclient.utils as rest
 
+# directories are listed with scandir where available (built in from
+# Python 3.5, or the scandir backport package)
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+# a saved login token is kept in the OS keyring if keyring is installed
+try:
+    import keyring
+except ImportError:
+    keyring = None
+
+# Parquet output for the metadata table is optional
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
 VERSION = '0.1'
 
 if hasattr(sys, '_MEIPASS'):
@@ -38,6 +82,64 @@ user_settings_path = "/".join(
     ]
 )
 
+# saved login token, used only when keyring isn't available & only
+# readable by the user
+token_cache_path = "/".join(
+    [
+        os.path.expanduser('~'),
+        '.reflow_download_token'
+    ]
+)
+
+# FCS header previews are cached per host & sample ID
+preview_cache_dir = "/".join(
+    [
+        os.path.expanduser('~'),
+        '.reflow_download_previews'
+    ]
+)
+
+# saved filter profiles by name
+filter_profiles_path = "/".join(
+    [
+        os.path.expanduser('~'),
+        '.reflow_download_profiles'
+    ]
+)
+
+# last sample list returned for each filter profile, shown right away when
+# the profile is applied
+profile_samples_path = "/".join(
+    [
+        os.path.expanduser('~'),
+        '.reflow_download_profile_samples'
+    ]
+)
+
+# IDs of the samples already fetched for each watched filter profile
+watch_state_path = "/".join(
+    [
+        os.path.expanduser('~'),
+        '.reflow_download_watch'
+    ]
+)
+
+# checksums of the clean files written by the client by host & path, the
+# server has none for clean files
+clean_fingerprints_path = "/".join(
+    [
+        os.path.expanduser('~'),
+        '.reflow_download_fingerprints'
+    ]
+)
+
+download_journal_path = "/".join(
+    [
+        os.path.expanduser('~'),
+        '.reflow_download_journal'
+    ]
+)
+
 default_download_parent_dir = "/".join(
     [
         os.path.expanduser('~'),
@@ -51,12 +153,24 @@ download_structure_options = [
     ('Nested - Project / Visit / Site', 'nested_pvs')
 ]
 
+download_output_options = [
+    ('Individual Files', 'folder'),
+    ('Tar Archive', 'tar'),
+    ('Zip Archive', 'zip')
+]
+
 download_version_options = [
     ('Clean', 'clean'),
     ('Original', 'original'),
     ('Both', 'both')
 ]
 
+conflict_policy_options = [
+    ('Skip', 'skip'),
+    ('Overwrite', 'overwrite'),
+    ('Save with a new name', 'rename')
+]
+
 BACKGROUND_COLOR = '#ededed'
 INACTIVE_BACKGROUND_COLOR = '#e2e2e2'
 INACTIVE_FOREGROUND_COLOR = '#767676'
@@ -76,6 +190,116 @@ PAD_EXTRA_LARGE = 14
 
 LABEL_WIDTH = 16
 
+# height of a sample row in the file list
+FILE_ROW_HEIGHT = 24
+
+# length of the substrings indexed for file name search
+SEARCH_NGRAM_SIZE = 3
+
+# most choices listed at once by a filter combobox
+MAX_FILTER_CHOICES = 100
+
+# columns of the metadata table written with each download batch, along
+# with the sample field holding each value
+SAMPLE_METADATA_COLUMNS = [
+    ('sample_id', 'id'),
+    ('original_filename', 'original_filename'),
+    ('project', 'project_name'),
+    ('site', 'site_name'),
+    ('subject', 'subject_code'),
+    ('visit', 'visit_name'),
+    ('panel', 'panel_name'),
+    ('stimulation', 'stimulation_name'),
+    ('sha1', 'sha1')
+]
+
+# sample fields holding the names chosen in the filter menus, used to apply
+# the filters locally to a project's prefetched sample list
+SAMPLE_FILTER_FIELDS = [
+    ('site_selection', 'site_name'),
+    ('subject_selection', 'subject_code'),
+    ('visit_selection', 'visit_name'),
+    ('panel_template_selection', 'panel_name'),
+    ('stimulation_selection', 'stimulation_name')
+]
+
+# filter menus saved in a filter profile: the selection, its choice
+# dictionary & the matching get_samples argument
+FILTER_PROFILE_FIELDS = [
+    ('project_selection', 'project_dict', 'project_pk'),
+    ('site_selection', 'site_dict', 'site_pk'),
+    ('subject_selection', 'subject_dict', 'subject_pk'),
+    ('visit_selection', 'visit_dict', 'visit_pk'),
+    ('panel_template_selection', 'panel_template_dict', 'project_panel_pk'),
+    ('stimulation_selection', 'stimulation_dict', 'stimulation_pk')
+]
+
+# read files in large blocks when computing checksums
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# number of REST requests (metadata & downloads) allowed in flight at once
+TRANSFER_WORKER_COUNT = 12
+
+# number of downloads of each version allowed in flight per host. Clean
+# files are generated by the server on request, so they get their own slots
+# and their generation overlaps the transfer of original files. Together
+# the slots stay below the worker count so metadata requests never wait
+# behind a large batch.
+MAX_DOWNLOADS_PER_HOST = {
+    'original': 4,
+    'clean': 4
+}
+
+# how often (in ms) the Tk event loop picks up finished REST requests
+TRANSFER_POLL_INTERVAL = 50
+
+# keyring service name for saved login tokens
+TOKEN_KEYRING_SERVICE = 'ReFlowDownloadClient'
+
+# time (in ms) between polls of the watched filter profiles
+WATCH_POLL_INTERVAL = 15 * 60 * 1000
+
+# quiet period (in ms) after the last filter change before filters are applied
+FILTER_DEBOUNCE_INTERVAL = 300
+
+# REST API paths for streaming sample downloads
+SAMPLE_DOWNLOAD_URL = 'https://%s/api/repository/samples/%d/download/'
+CLEAN_SAMPLE_DOWNLOAD_URL = (
+    'https://%s/api/repository/samples/%d/download_clean/'
+)
+
+# bytes read from the network per iteration while streaming a download
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+# number of files sized per request when ordering a queue smallest first
+QUEUE_SIZE_FETCH_COUNT = 50
+
+# minimum time (in seconds) between refreshes of the download queue window
+QUEUE_REFRESH_INTERVAL = 1
+
+# time (in seconds) between repaints of the download progress
+PROGRESS_REFRESH_INTERVAL = 0.25
+
+# size of the write buffer for downloaded files, large blocks keep network
+# filesystems from fragmenting files & cut down on metadata traffic
+WRITE_BUFFER_SIZE = 4 * 1024 * 1024
+
+# suffix of the temporary name a file is written to before it is renamed
+PARTIAL_FILE_SUFFIX = '.part'
+
+# name of the index member listing the samples in a downloaded archive
+ARCHIVE_INDEX_NAME = 'index.csv'
+
+# size of the FCS HEADER segment (version & segment offsets)
+FCS_HEADER_SIZE = 58
+
+# number of files sized to estimate the total size of a download
+PREFLIGHT_SAMPLE_COUNT = 20
+
+# warn before a download expected to use more than this fraction of the
+# free space on the target filesystem
+PREFLIGHT_FREE_SPACE_RATIO = 0.9
+
 
 class MyCheckbutton(Tkinter.Checkbutton):
     def __init__(self, sample_dict, *args, **kwargs):
@@ -90,6 +314,12 @@ class MyCheckbutton(Tkinter.Checkbutton):
         kwargs['highlightthickness'] = 0
         Tkinter.Checkbutton.__init__(self, *args, **kwargs)
 
+        # position in the sorted sample list, and the row currently shown
+        # in the file list canvas (None while hidden by a search)
+        self.canvas_item = None
+        self.sample_row = None
+        self.row = None
+
     def is_checked(self):
         return self.var.get()
 
@@ -100,1165 +330,4894 @@ class MyCheckbutton(Tkinter.Checkbutton):
         self.var.set(0)
 
 
-class Application(Tkinter.Frame):
-
-    def __init__(self, master):
+class SampleIndex(object):
+    """
+    Search index over a list of names, the file names shown in the file
+    list or the choices of a filter menu.
 
-        # check for previously used host & username for this user
-        # noinspection PyBroadException
-        try:
-            user_settings = json.load(open(user_settings_path, 'r'))
-            self.host = user_settings['host']
-            self.username = user_settings['username']
-        except Exception:
-            self.host = None
-            self.username = None
+    Prefix queries shorter than an n-gram are answered by bisecting the
+    sorted names, longer queries by intersecting the rows containing each
+    of the query's n-grams. Results are row positions in display order.
+    """
+    def __init__(self, names):
+        self.names = [name.lower() for name in names]
 
-        # Neither the user's token nor their password are cached
-        self.token = None
+        self.sorted_keys = sorted(
+            [(name, row) for row, name in enumerate(self.names)]
+        )
+        self.sorted_names = [key[0] for key in self.sorted_keys]
+
+        self.ngrams = {}
+        for row, name in enumerate(self.names):
+            for i in range(len(name) - SEARCH_NGRAM_SIZE + 1):
+                ngram = name[i:i + SEARCH_NGRAM_SIZE]
+                if ngram in self.ngrams:
+                    self.ngrams[ngram].add(row)
+                else:
+                    self.ngrams[ngram] = set([row])
+
+    def search_prefix(self, text):
+        rows = []
+        start = bisect.bisect_left(self.sorted_names, text)
+        for name, row in self.sorted_keys[start:]:
+            if not name.startswith(text):
+                break
+            rows.append(row)
+
+        return sorted(rows)
+
+    def search(self, text):
+        text = text.lower()
+        if len(text) < SEARCH_NGRAM_SIZE:
+            return self.search_prefix(text)
+
+        row_sets = []
+        for i in range(len(text) - SEARCH_NGRAM_SIZE + 1):
+            ngram = text[i:i + SEARCH_NGRAM_SIZE]
+            if ngram not in self.ngrams:
+                return []
+            row_sets.append(self.ngrams[ngram])
+
+        # intersect starting with the rarest n-gram
+        row_sets.sort(key=len)
+        rows = row_sets[0].intersection(*row_sets[1:])
+
+        # n-grams may match out of order, so confirm the substring
+        return sorted([row for row in rows if text in self.names[row]])
+
+
+class FilterCombobox(ttk.Combobox):
+    """
+    Type-ahead chooser for a filter menu with many choices. Only a bounded
+    number of the choices matching the typed text are listed, and the
+    selection variable is only ever set to a whole choice (or cleared).
+    """
+    def __init__(self, master, selection, **kwargs):
+        ttk.Combobox.__init__(self, master, **kwargs)
+        self.selection = selection
+
+        # choices in sorted order, by lower case name & the search index
+        # over them (built on the first search)
+        self.choices = []
+        self.choice_names = {}
+        self.choice_index = None
+        self.matches = []
+
+        self.bind('<KeyRelease>', self.update_matches)
+        self.bind('<<ComboboxSelected>>', self.choose)
+        self.bind('<Return>', self.choose)
+
+        # text left unchosen never outlives the focus, the box always shows
+        # the selection the filters actually use
+        self.bind('<FocusOut>', self.show_selection)
+        self.selection.trace('w', self.show_selection)
+
+    def set_choices(self, choices):
+        self.choices = sorted(choices)
+        self.choice_names = dict(
+            [(choice.lower(), choice) for choice in self.choices]
+        )
+        self.choice_index = None
+        self.set_matches(self.choices[:MAX_FILTER_CHOICES])
 
-        # Using the names (project, site, etc.) as the key, pk as the value
-        # for the choice dictionaries below.
-        # The names need to be unique (and they should be) and
-        # it's more convenient to lookup by key using the name.
-        self.project_dict = dict()
-        self.site_dict = dict()
-        self.subject_dict = dict()
-        self.visit_dict = dict()
-        self.panel_template_dict = dict()
-        self.stimulation_dict = dict()
+    def set_matches(self, matches):
+        self.matches = matches
+        self['values'] = matches
 
-        # start the metadata menus
-        self.project_menu = None
-        self.project_selection = Tkinter.StringVar()
-        self.project_selection.trace("w", self.update_metadata)
+    # noinspection PyUnusedLocal
+    def update_matches(self, event=None):
+        if event is not None and event.keysym in ['Return', 'Up', 'Down']:
+            return
 
-        self.site_menu = None
-        self.site_selection = Tkinter.StringVar()
+        text = self.get().strip()
+        if not text:
+            self.set_matches(self.choices[:MAX_FILTER_CHOICES])
+            return
 
-        self.subject_menu = None
-        self.subject_selection = Tkinter.StringVar()
+        if self.choice_index is None:
+            self.choice_index = SampleIndex(self.choices)
+        rows = self.choice_index.search(text)[:MAX_FILTER_CHOICES]
+        self.set_matches([self.choices[row] for row in rows])
+
+    # noinspection PyUnusedLocal
+    def choose(self, event=None):
+        text = self.get().strip()
+        if not text:
+            value = ''
+        elif text.lower() in self.choice_names:
+            value = self.choice_names[text.lower()]
+        elif len(self.matches) == 1:
+            value = self.matches[0]
+        else:
+            # not a choice, go back to the current selection
+            self.show_selection()
+            return
 
-        self.visit_menu = None
-        self.visit_selection = Tkinter.StringVar()
+        if value != self.selection.get():
+            self.selection.set(value)
+        else:
+            self.show_selection()
 
-        self.stimulation_menu = None
-        self.stimulation_selection = Tkinter.StringVar()
+    def show_selection(self, *args):
+        self.set(self.selection.get())
 
-        self.panel_template_menu = None
-        self.panel_template_selection = Tkinter.StringVar()
 
-        # download options
-        self.download_parent_dir = Tkinter.StringVar()
-        self.download_parent_dir.set(default_download_parent_dir)
-        self.download_structure = Tkinter.StringVar()
-        # default output structure is 'flat'
-        self.download_structure.set('flat')
-        # download version to specify downloading of original or clean
-        # FCS samples (or both)
-        self.download_version = Tkinter.StringVar()
-        self.download_version.set('clean')
+def load_json_file(path):
+    # noinspection PyBroadException
+    try:
+        return json.load(open(path, 'r'))
+    except Exception:
+        return {}
 
-        # can't call super on old-style class, call parent init directly
-        Tkinter.Frame.__init__(self, master)
-        if sys.platform == 'linux2':
-            pass
-        else:
-            self.master.iconbitmap(ICON_PATH)
-        self.master.title('ReFlow Download Client - ' + VERSION)
-        self.master.minsize(width=WINDOW_WIDTH, height=WINDOW_HEIGHT)
-        self.master.config(bg=BACKGROUND_COLOR)
 
-        self.menu_bar = Tkinter.Menu(master)
-        self.master.config(menu=self.menu_bar)
+def save_json_file(path, data):
+    # noinspection PyBroadException
+    try:
+        json_fh = open(path, 'w')
+        json.dump(data, json_fh)
+        json_fh.close()
+    except Exception:
+        # well, we tried, but don't stop the application
+        pass
 
-        self.download_progress_bar = None
-        self.file_list_canvas = None
 
-        self.s = ttk.Style()
-        self.s.map(
-            'Inactive.TButton',
-            foreground=[('disabled', INACTIVE_FOREGROUND_COLOR)])
+def save_clean_fingerprints(host, fingerprints):
+    # merged into the fingerprints recorded for the host's files
+    if not fingerprints:
+        return
 
-        self.pack()
+    clean_fingerprints = load_json_file(clean_fingerprints_path)
+    clean_fingerprints.setdefault(host, {}).update(fingerprints)
+    save_json_file(clean_fingerprints_path, clean_fingerprints)
 
-        self.login_frame = Tkinter.Frame(bg=BACKGROUND_COLOR)
-        self.logo_image = ImageTk.PhotoImage(Image.open(LOGO_PATH))
-        self.load_login_frame()
-        # self.load_main_frame()
 
-    def load_login_frame(self):
-        # noinspection PyUnusedLocal
-        def login(*args):
-            host_text = host_entry.get()
-            self.username = user_entry.get()
-            password = password_entry.get()
+def load_user_settings():
+    return load_json_file(user_settings_path)
 
-            # remove 'http://' or trailing slash from host text if present
-            matches = re.search('^(https://)?([^/]+)(/)*', host_text)
 
-            try:
-                self.host = matches.groups()[1]
-                self.token = rest.get_token(self.host, self.username, password)
-            except Exception, e:
-                print e
-            if not self.token:
-                tkMessageBox.showwarning(
-                    'Login Failed',
-                    'Are the hostname, username, and password are correct?'
-                )
-                return
+def save_user_settings(**values):
+    """
+    Updates the given values in the user settings file, keeping any other
+    saved settings.
+    """
+    user_settings = load_user_settings()
+    user_settings.update(values)
 
-            if self.token is not None:
-                # if we get here, user was authenticated,
-                # cache the host/username
-                # noinspection PyBroadException
-                try:
-                    user_settings = {
-                        'host': host_text,
-                        'username': self.username
-                    }
-                    user_settings_fh = open(user_settings_path, 'w')
-                    json.dump(user_settings, user_settings_fh)
-                except Exception:
-                    # well, we tried, but don't stop the application
-                    pass
+    save_json_file(user_settings_path, user_settings)
 
-            self.login_frame.destroy()
-            self.master.unbind('<Return>')
-            self.load_main_frame()
 
-        self.master.bind('<Return>', login)
+def get_host_name(host_text):
+    # remove 'http://' or trailing slash from host text if present
+    matches = re.search('^(https://)?([^/]+)(/)*', host_text)
+    if matches is None:
+        return None
+    return matches.groups()[1]
 
-        logo_label = Tkinter.Label(self.login_frame, image=self.logo_image)
-        logo_label.config(bg=BACKGROUND_COLOR)
-        logo_label.pack(side='top', pady=PAD_EXTRA_LARGE)
 
-        host_entry_frame = Tkinter.Frame(self.login_frame, bg=BACKGROUND_COLOR)
-        host_label = Tkinter.Label(
-            host_entry_frame,
-            text='Hostname',
-            bg=BACKGROUND_COLOR,
-            width=8,
-            anchor='e'
+def load_cached_token(host, username):
+    if keyring is not None:
+        # noinspection PyBroadException
+        try:
+            return keyring.get_password(
+                TOKEN_KEYRING_SERVICE,
+                '%s@%s' % (username, host)
+            )
+        except Exception:
+            return None
+
+    token_cache = load_json_file(token_cache_path)
+    if token_cache.get('host') != host:
+        return None
+    if token_cache.get('username') != username:
+        return None
+    return token_cache.get('token')
+
+
+def save_cached_token(host, username, token):
+    """
+    Saves a login token in the OS keyring, or without keyring in a file
+    only the user can read.
+    """
+    if keyring is not None:
+        # noinspection PyBroadException
+        try:
+            keyring.set_password(
+                TOKEN_KEYRING_SERVICE,
+                '%s@%s' % (username, host),
+                token
+            )
+        except Exception:
+            pass
+        return
+
+    # noinspection PyBroadException
+    try:
+        token_fd = os.open(
+            token_cache_path,
+            os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+            0o600
         )
-        host_label.pack(side='left')
-        host_entry = Tkinter.Entry(
-            host_entry_frame,
-            highlightbackground=BACKGROUND_COLOR,
-            width=24
+        # an existing file keeps its mode when opened
+        os.chmod(token_cache_path, 0o600)
+        token_fh = os.fdopen(token_fd, 'w')
+        json.dump(
+            {'host': host, 'username': username, 'token': token},
+            token_fh
         )
-        if self.host is not None:
-            host_entry.insert(Tkinter.END, self.host)
-        host_entry.pack(padx=PAD_SMALL)
-        host_entry_frame.pack(pady=PAD_SMALL)
+        token_fh.close()
+    except Exception:
+        # well, we tried, the user will just have to log in next time
+        pass
 
-        user_entry_frame = Tkinter.Frame(self.login_frame, bg=BACKGROUND_COLOR)
-        user_label = Tkinter.Label(
-            user_entry_frame,
-            text='Username',
-            bg=BACKGROUND_COLOR,
-            width=8,
-            anchor='e'
-        )
-        user_label.pack(side='left')
-        user_entry = Tkinter.Entry(
-            user_entry_frame,
-            highlightbackground=BACKGROUND_COLOR,
-            width=24
-        )
-        if self.username is not None:
-            user_entry.insert(Tkinter.END, self.username)
-        user_entry.pack(padx=PAD_SMALL)
-        user_entry_frame.pack(pady=PAD_SMALL)
 
-        password_entry_frame = Tkinter.Frame(
-            self.login_frame,
-            bg=BACKGROUND_COLOR
-        )
-        password_label = Tkinter.Label(
-            password_entry_frame,
-            text='Password',
-            bg=BACKGROUND_COLOR,
-            width=8,
-            anchor='e'
-        )
-        password_label.pack(side='left')
-        password_entry = Tkinter.Entry(
-            password_entry_frame,
-            show='*',
-            highlightbackground=BACKGROUND_COLOR,
-            width=24
-        )
-        password_entry.pack(padx=PAD_SMALL)
-        password_entry_frame.pack(pady=PAD_SMALL)
+def discard_cached_token(host, username):
+    if keyring is not None:
+        # noinspection PyBroadException
+        try:
+            keyring.delete_password(
+                TOKEN_KEYRING_SERVICE,
+                '%s@%s' % (username, host)
+            )
+        except Exception:
+            pass
 
-        login_button_frame = Tkinter.Frame(
-            self.login_frame,
-            bg=BACKGROUND_COLOR
-        )
-        login_button_label = Tkinter.Label(
-            login_button_frame,
-            bg=BACKGROUND_COLOR
+    if os.path.isfile(token_cache_path):
+        os.remove(token_cache_path)
+
+
+def format_id_list(ids):
+    """
+    Returns sample IDs as a compact list with runs of consecutive IDs
+    written as ranges, e.g. '3-7,12,15-16'.
+    """
+    ranges = []
+    for sample_id in sorted(set(ids)):
+        if ranges and ranges[-1][1] == sample_id - 1:
+            ranges[-1][1] = sample_id
+        else:
+            ranges.append([sample_id, sample_id])
+
+    return ','.join(
+        [
+            str(start) if start == end else '%d-%d' % (start, end)
+            for start, end in ranges
+        ]
+    )
+
+
+def parse_id_list(text):
+    """
+    Returns the set of sample IDs in a list written by format_id_list,
+    separated by commas or whitespace. Raises ValueError if the text isn't
+    an ID list.
+    """
+    ids = set()
+    for item in re.split(r'[,\s]+', text.strip()):
+        if not item:
+            continue
+
+        if '-' in item:
+            start, end = item.split('-', 1)
+            ids.update(range(int(start), int(end) + 1))
+        else:
+            ids.add(int(item))
+
+    return ids
+
+
+def get_free_space(path):
+    """
+    Returns the number of bytes available to the user on the filesystem
+    containing path.
+    """
+    if hasattr(os, 'statvfs'):
+        fs_stats = os.statvfs(path)
+        return fs_stats.f_bavail * fs_stats.f_frsize
+
+    free_bytes = ctypes.c_ulonglong(0)
+    ctypes.windll.kernel32.GetDiskFreeSpaceExW(
+        ctypes.c_wchar_p(path),
+        None,
+        None,
+        ctypes.pointer(free_bytes)
+    )
+    return free_bytes.value
+
+
+def format_duration(seconds):
+    if seconds < 60:
+        return '%d seconds' % seconds
+    elif seconds < 3600:
+        return '%d minutes' % (seconds / 60)
+    return '%.1f hours' % (seconds / 3600.0)
+
+
+def get_batch_name():
+    # the metadata table (and archive) of a batch are named after its
+    # start time
+    return 'reflow_download_%s' % time.strftime('%Y%m%d_%H%M%S')
+
+
+def get_unused_file_name(file_name, existing_names):
+    # number the file name until it is free, e.g. sample_1.fcs
+    base_name, extension = os.path.splitext(file_name)
+    i = 1
+    while True:
+        new_file_name = '%s_%d%s' % (base_name, i, extension)
+        if new_file_name not in existing_names:
+            return new_file_name
+        i += 1
+
+
+def get_numbered_copies(file_name, entries):
+    # existing files numbered from the file name by get_unused_file_name,
+    # in the order they were made. Names reserved for files that aren't
+    # written yet have no size.
+    base_name, extension = os.path.splitext(file_name)
+    pattern = re.compile(
+        r'^%s_(\d+)%s$' % (re.escape(base_name), re.escape(extension))
+    )
+    copies = []
+    for name, (is_file, size, modified_time) in entries.items():
+        match = pattern.match(name)
+        if match is not None and is_file and size is not None:
+            copies.append((int(match.group(1)), name))
+
+    return [name for i, name in sorted(copies)]
+
+
+def scan_directory(dir_path):
+    """
+    Returns the entries of a directory as a dictionary of name to
+    (is_file, size, modification time), or None if the directory doesn't
+    exist. Links are not followed, so a link is never taken for a file.
+    """
+    entries = {}
+    try:
+        if scandir is not None:
+            for entry in scandir(dir_path):
+                # noinspection PyArgumentList
+                entry_stat = entry.stat(follow_symlinks=False)
+                entries[entry.name] = (
+                    stat.S_ISREG(entry_stat.st_mode),
+                    entry_stat.st_size,
+                    entry_stat.st_mtime
+                )
+            return entries
+
+        names = os.listdir(dir_path)
+    except OSError, e:
+        if e.errno == errno.ENOENT:
+            return None
+        raise
+
+    for name in names:
+        try:
+            entry_stat = os.lstat("/".join([dir_path, name]))
+        except OSError:
+            # removed since the listing
+            continue
+        entries[name] = (
+            stat.S_ISREG(entry_stat.st_mode),
+            entry_stat.st_size,
+            entry_stat.st_mtime
         )
-        login_button = ttk.Button(
-            login_button_label,
-            text='Login',
-            command=login
+
+    return entries
+
+
+def get_sample_file_name(sample_metadata, clean=False):
+    orig_file_name = sample_metadata['original_filename']
+    if not clean:
+        return orig_file_name
+
+    pattern = re.compile(r'\.fcs$')
+    match = pattern.search(orig_file_name.lower())
+
+    if match is not None:
+        return "_".join([orig_file_name[0:match.start()], 'clean.fcs'])
+    else:
+        return "_".join([orig_file_name, 'clean.fcs'])
+
+
+class DownloadJob(object):
+    """
+    A single file to download: either the original or the clean version
+    of a sample, along with the directory it is saved to.
+    """
+    def __init__(self, sample_metadata, sample_dir, clean=False):
+        self.sample_metadata = sample_metadata
+        self.sample_dir = sample_dir
+        self.clean = clean
+        self.file_name = get_sample_file_name(sample_metadata, clean)
+
+        # last state recorded in the download journal (if any)
+        self.state = None
+
+        # scheduling within a batch: position in the batch, pinned to the
+        # top of the queue by the user, expected size (for smallest first
+        # ordering) & cancellation of the transfer
+        self.order = 0
+        self.pinned = False
+        self.expected_size = None
+        self.cancel_event = threading.Event()
+
+        # checksum & stat of a clean file recorded when it is written
+        self.fingerprint = None
+
+        # under the rename policy: the conflict that was found & numbered
+        # copies from earlier batches still to be checked against
+        self.conflict_reason = None
+        self.conflict_path = None
+        self.copy_candidates = []
+
+    @property
+    def version(self):
+        if self.clean:
+            return 'clean'
+        return 'original'
+
+    @property
+    def key(self):
+        return '%s:%s' % (self.sample_metadata['id'], self.version)
+
+    @property
+    def path(self):
+        if not self.sample_dir:
+            # flat layout inside an archive
+            return self.file_name
+        return "/".join([self.sample_dir, self.file_name])
+
+    def to_dict(self):
+        return {
+            'sample': self.sample_metadata,
+            'sample_dir': self.sample_dir,
+            'clean': self.clean
+        }
+
+    @classmethod
+    def from_dict(cls, job_dict):
+        return cls(
+            job_dict['sample'],
+            job_dict['sample_dir'],
+            clean=job_dict['clean']
         )
-        login_button.pack()
-        login_button_label.pack(side='right')
-        login_button_frame.pack(fill='x')
 
-        self.login_frame.place(in_=self.master, anchor='c', relx=.5, rely=.5)
 
-    def load_main_frame(self):
-        main_frame = Tkinter.Frame(self.master, bg=BACKGROUND_COLOR)
-        main_frame.pack(
-            fill='both',
-            expand=True,
-            anchor='n',
-            padx=PAD_MEDIUM,
-            pady=PAD_MEDIUM
-        )
+def sha1_file(path):
+    """
+    Returns the hex SHA-1 digest of the file at the given path, reading the
+    file in blocks so large FCS files are never held in memory.
+    """
+    sha1_hash = hashlib.sha1()
+    with open(path, 'rb') as sample_file:
+        while True:
+            block = sample_file.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            sha1_hash.update(block)
+
+    return sha1_hash.hexdigest()
+
+
+class HashVerifier(object):
+    """
+    Computes SHA-1 checksums of existing files on a pool of worker threads.
+
+    Both file reads and hashlib release the GIL for large blocks, so the
+    workers scale across cores. Threads are only started once the first
+    file is submitted.
+    """
+    def __init__(self, worker_count=None):
+        if worker_count is None:
+            worker_count = multiprocessing.cpu_count()
+        self.worker_count = worker_count
+        self.workers = []
+        self.pending = 0
+
+        self.task_queue = Queue.Queue()
+        self.result_queue = Queue.Queue()
+
+    def submit(self, job):
+        if not self.workers:
+            for i in range(self.worker_count):
+                worker = threading.Thread(target=self._work)
+                worker.daemon = True
+                worker.start()
+                self.workers.append(worker)
+
+        self.pending += 1
+        self.task_queue.put(job)
+
+    def _work(self):
+        while True:
+            job = self.task_queue.get()
+            if job is None:
+                return
 
-        top_frame = Tkinter.Frame(
-            main_frame,
-            bg=BACKGROUND_COLOR
-        )
-        top_frame.pack(
-            fill='x',
-            expand=False,
-            anchor='n',
-            padx=PAD_MEDIUM,
-            pady=PAD_MEDIUM
-        )
+            try:
+                sha1_digest = sha1_file(job.path)
+            except (IOError, OSError):
+                sha1_digest = None
+
+            self.result_queue.put((job, sha1_digest))
+
+    def finished(self, timeout=None):
+        """
+        Yields (job, sha1 digest) tuples for completed checks. Without a
+        timeout only results that are already available are returned.
+        """
+        while self.pending > 0:
+            try:
+                if timeout is None:
+                    job, sha1_digest = self.result_queue.get_nowait()
+                else:
+                    job, sha1_digest = self.result_queue.get(timeout=timeout)
+            except Queue.Empty:
+                return
 
-        middle_frame = Tkinter.Frame(main_frame, bg=BACKGROUND_COLOR)
-        middle_frame.pack(
-            fill='both',
-            expand=True,
-            anchor='n'
+            self.pending -= 1
+            yield job, sha1_digest
+
+    def shutdown(self):
+        for worker in self.workers:
+            self.task_queue.put(None)
+        self.workers = []
+
+
+class TransferStats(object):
+    """
+    Running totals for the session's downloads, updated from the worker
+    threads.
+
+    bytes_received counts bytes on the wire (possibly compressed) while
+    bytes_written counts the decompressed bytes saved to disk.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.file_count = 0
+        self.bytes_received = 0
+        self.bytes_written = 0
+
+    def add(self, bytes_received, bytes_written):
+        with self.lock:
+            self.bytes_received += bytes_received
+            self.bytes_written += bytes_written
+
+    def add_file(self):
+        with self.lock:
+            self.file_count += 1
+
+    def summary(self):
+        with self.lock:
+            text = 'Downloaded %d file(s), %s' % (
+                self.file_count,
+                format_byte_count(self.bytes_written)
+            )
+            if self.bytes_written > self.bytes_received > 0:
+                text += ' (%s transferred, %d%% saved by compression)' % (
+                    format_byte_count(self.bytes_received),
+                    100 - (100 * self.bytes_received / self.bytes_written)
+                )
+        return text
+
+
+def format_byte_count(byte_count):
+    for unit in ['bytes', 'KB', 'MB', 'GB']:
+        if byte_count < 1024:
+            break
+        byte_count /= 1024.0
+    else:
+        unit = 'TB'
+
+    if unit == 'bytes':
+        return '%d %s' % (byte_count, unit)
+    return '%.1f %s' % (byte_count, unit)
+
+
+# each worker thread keeps its own HTTP session so connections are reused
+_thread_local = threading.local()
+
+
+def get_http_session():
+    if not hasattr(_thread_local, 'session'):
+        _thread_local.session = requests.Session()
+    return _thread_local.session
+
+
+def get_decompressor(content_encoding):
+    """
+    Returns a zlib decompressor for the given Content-Encoding header
+    value, or None if the response body is not compressed.
+    """
+    content_encoding = (content_encoding or '').strip().lower()
+    if content_encoding == 'gzip':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif content_encoding == 'deflate':
+        return zlib.decompressobj()
+    return None
+
+
+def is_stream_complete(decompressor):
+    """
+    Returns whether a zlib decompressor has reached the end of its stream,
+    checked before it is flushed. zlib in Python 2 has no eof flag, but any
+    input past the end of the stream is left in unused_data.
+    """
+    if decompressor.unused_data:
+        return True
+
+    probe = decompressor.copy()
+    try:
+        probe.decompress('\0')
+    except zlib.error:
+        return False
+    return probe.unused_data == '\0'
+
+
+class DownloadCancelled(Exception):
+    pass
+
+
+class DownloadIncomplete(Exception):
+    pass
+
+
+def stream_sample(
+        host,
+        token,
+        sample_id,
+        sample_file,
+        clean=False,
+        stats=None,
+        cancel_event=None
+):
+    """
+    Downloads an original or clean FCS file into the given open file object,
+    asking the server for a compressed transfer. Compressed data is inflated
+    while it streams to disk, so the file is never buffered in memory.
+
+    Setting cancel_event stops the transfer after the current chunk by
+    raising DownloadCancelled, closing the connection. A body cut short
+    raises DownloadIncomplete.
+    """
+    if clean:
+        url = CLEAN_SAMPLE_DOWNLOAD_URL % (host, sample_id)
+    else:
+        url = SAMPLE_DOWNLOAD_URL % (host, sample_id)
+
+    response = get_http_session().get(
+        url,
+        headers={
+            'Authorization': 'Token %s' % token,
+            'Accept-Encoding': 'gzip, deflate'
+        },
+        stream=True
+    )
+
+    try:
+        response.raise_for_status()
+
+        decompressor = get_decompressor(
+            response.headers.get('Content-Encoding')
         )
 
-        bottom_frame = Tkinter.Frame(main_frame, bg=BACKGROUND_COLOR)
-        bottom_frame.pack(
-            fill='x',
-            expand=False,
-            anchor='n',
-            padx=PAD_MEDIUM,
-            pady=PAD_MEDIUM
-        )
+        # the size on disk is only known up front for uncompressed data
+        content_length = response.headers.get('Content-Length')
+        if decompressor is None and content_length is not None:
+            if hasattr(sample_file, 'preallocate'):
+                sample_file.preallocate(int(content_length))
+
+        received_bytes = 0
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                raise DownloadCancelled()
+
+            # read the raw (possibly compressed) bytes off the wire
+            chunk = response.raw.read(
+                DOWNLOAD_CHUNK_SIZE,
+                decode_content=False
+            )
+            if not chunk:
+                break
+            received_bytes += len(chunk)
+
+            data = chunk
+            if decompressor is not None:
+                data = decompressor.decompress(chunk)
+            sample_file.write(data)
+
+            if stats is not None:
+                stats.add(len(chunk), len(data))
+
+        # Content-Length counts the bytes on the wire, compressed or not
+        if content_length is not None:
+            if received_bytes != int(content_length):
+                raise DownloadIncomplete(
+                    'received %d of %s bytes' % (
+                        received_bytes,
+                        content_length
+                    )
+                )
 
-        # Action buttons all go in top frame
-        apply_filters_button = ttk.Button(
-            top_frame,
-            text='Apply Filters',
-            command=self.apply_filters
-        )
+        if decompressor is not None:
+            if not is_stream_complete(decompressor):
+                raise DownloadIncomplete('compressed data ended early')
+
+            data = decompressor.flush()
+            sample_file.write(data)
+
+            if stats is not None:
+                stats.add(0, len(data))
+    finally:
+        response.close()
+
+    if stats is not None:
+        stats.add_file()
+
+
+def fetch_sample_bytes(host, token, sample_id, start, end):
+    """
+    Returns bytes start through end (inclusive) of an original FCS file
+    using a Range request. If the server ignores the range only the bytes
+    up to end are read before the connection is closed.
+    """
+    response = get_http_session().get(
+        SAMPLE_DOWNLOAD_URL % (host, sample_id),
+        headers={
+            'Authorization': 'Token %s' % token,
+            'Range': 'bytes=%d-%d' % (start, end),
+            # byte offsets refer to the uncompressed file
+            'Accept-Encoding': 'identity'
+        },
+        stream=True
+    )
+
+    try:
+        response.raise_for_status()
+        if response.status_code == 206:
+            return response.raw.read(end - start + 1)
+
+        return response.raw.read(end + 1)[start:]
+    finally:
+        response.close()
+
+
+def fetch_sample_size(host, token, sample_id):
+    """
+    Returns the size of an original FCS file, or None if the server doesn't
+    report it. Only the first byte is requested (the total size is in the
+    Content-Range), so the server doesn't start sending the whole file. If
+    the server ignores the range the Content-Length is used instead.
+    """
+    response = get_http_session().get(
+        SAMPLE_DOWNLOAD_URL % (host, sample_id),
+        headers={
+            'Authorization': 'Token %s' % token,
+            'Range': 'bytes=0-0',
+            'Accept-Encoding': 'identity'
+        },
+        stream=True
+    )
+
+    try:
+        response.raise_for_status()
+        if response.status_code == 206:
+            # e.g. bytes 0-0/1234, the total is * if it isn't known
+            content_range = response.headers.get('Content-Range', '')
+            size = content_range.rpartition('/')[2].strip()
+        else:
+            size = response.headers.get('Content-Length')
+    finally:
+        response.close()
+
+    if size is None or not size.isdigit():
+        return None
+    return int(size)
+
+
+def estimate_download_size(host, token, jobs):
+    """
+    Estimates the bytes needed for the given jobs from the sizes of a random
+    sample of their original files. Clean files hold a subset of the
+    original's events, so counting them at the original size errs on the
+    safe side. Returns None if no sizes are available.
+    """
+    if not jobs:
+        return 0
+
+    sample_ids = list(set([job.sample_metadata['id'] for job in jobs]))
+    sample_ids = random.sample(
+        sample_ids,
+        min(PREFLIGHT_SAMPLE_COUNT, len(sample_ids))
+    )
+
+    sizes = []
+    for sample_id in sample_ids:
+        # noinspection PyBroadException
+        try:
+            size = fetch_sample_size(host, token, sample_id)
+        except Exception:
+            continue
+        if size is not None:
+            sizes.append(size)
 
-        apply_filters_button.pack(side='left')
+    if not sizes:
+        return None
 
-        download_selected_button = ttk.Button(
-            top_frame,
-            text='Download Selected',
-            command=self.download_selected
-        )
+    return int(float(sum(sizes)) / len(sizes) * len(jobs))
 
-        download_selected_button.pack(side='right')
 
-        # Clear all button
-        file_clear_all_button = ttk.Button(
-            top_frame,
-            text='Clear All',
-            command=self.clear_all_files
+def get_transfer_jobs(jobs):
+    """
+    Returns the jobs whose file isn't in its directory yet, listing each
+    directory once. Like the batch, any existing entry counts as present.
+    """
+    dir_entries = {}
+    transfer_jobs = []
+    for job in jobs:
+        if job.sample_dir not in dir_entries:
+            try:
+                dir_entries[job.sample_dir] = scan_directory(job.sample_dir)
+            except OSError:
+                # unreadable, the batch reports it when it starts
+                dir_entries[job.sample_dir] = None
+
+        entries = dir_entries[job.sample_dir]
+        if entries is None or job.file_name not in entries:
+            transfer_jobs.append(job)
+
+    return transfer_jobs
+
+
+def plan_download(host, token, jobs, skip_existing):
+    """
+    Returns the jobs left to transfer & their estimated size in bytes (None
+    if unknown), skipping files already on disk if skip_existing is set.
+    """
+    if skip_existing:
+        transfer_jobs = get_transfer_jobs(jobs)
+    else:
+        transfer_jobs = jobs
+
+    return transfer_jobs, estimate_download_size(host, token, transfer_jobs)
+
+
+def fetch_sample_sizes(host, token, sample_ids):
+    """
+    Returns a dictionary of original FCS file sizes by sample ID, samples
+    whose size can't be read are left out.
+    """
+    sizes = {}
+    for sample_id in sample_ids:
+        # noinspection PyBroadException
+        try:
+            size = fetch_sample_size(host, token, sample_id)
+        except Exception:
+            continue
+        if size is not None:
+            sizes[sample_id] = size
+
+    return sizes
+
+
+def parse_fcs_text(text):
+    """
+    Returns a dictionary of the keyword/value pairs in an FCS TEXT segment.
+    The first character is the delimiter, a doubled delimiter is an escaped
+    delimiter character within a keyword or value.
+    """
+    delimiter = text[0]
+    tokens = []
+    token = []
+
+    i = 1
+    while i < len(text):
+        if text[i] == delimiter:
+            if text[i + 1:i + 2] == delimiter:
+                token.append(delimiter)
+                i += 2
+                continue
+            tokens.append(''.join(token))
+            token = []
+        else:
+            token.append(text[i])
+        i += 1
+
+    return dict(
+        [
+            (keyword.strip().upper(), value.strip())
+            for keyword, value in zip(tokens[0::2], tokens[1::2])
+        ]
+    )
+
+
+def fetch_fcs_header(host, token, sample_id):
+    """
+    Fetches only the HEADER & TEXT segments of an FCS file, returning the
+    FCS version and the TEXT keywords.
+    """
+    header = fetch_sample_bytes(host, token, sample_id, 0, FCS_HEADER_SIZE - 1)
+    if len(header) < FCS_HEADER_SIZE or not header.startswith('FCS'):
+        raise ValueError('Sample %s is not an FCS file' % sample_id)
+
+    text_start = int(header[10:18])
+    text_end = int(header[18:26])
+
+    text = fetch_sample_bytes(host, token, sample_id, text_start, text_end)
+
+    return {
+        'version': header[0:6],
+        'keywords': parse_fcs_text(text.decode('latin-1'))
+    }
+
+
+# posix_fallocate isn't exposed by the os module in Python 2, use libc
+# directly where it's available (not on Mac OS or Windows)
+# noinspection PyBroadException
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    _posix_fallocate = _libc.posix_fallocate64
+    _posix_fallocate.argtypes = [ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+except Exception:
+    _posix_fallocate = None
+
+
+# temporary files are created readable by their owner only, finished files
+# get the permissions of any other new file. The umask can only be read by
+# setting it.
+_umask = os.umask(0)
+os.umask(_umask)
+
+
+class AtomicFileWriter(object):
+    """
+    Writes a file under a temporary name in large buffered blocks, renaming
+    it to the final path only once it is complete, so no partially written
+    file ever has the final name. Space can be preallocated when the size is
+    known up front.
+
+    Files aren't synced to disk on close, call sync_files once for all the
+    files written in a batch. If a hashlib digest is given it is updated
+    with the data as it's written.
+    """
+    def __init__(self, path, digest=None):
+        self.path = path
+
+        # each writer gets its own temporary file, so writers for the same
+        # path never share (and publish) each other's data
+        directory, file_name = os.path.split(path)
+        fd, self.temp_path = tempfile.mkstemp(
+            suffix=PARTIAL_FILE_SUFFIX,
+            prefix=self.get_temp_prefix(path),
+            dir=directory or '.'
         )
+        self.file = os.fdopen(fd, 'wb', WRITE_BUFFER_SIZE)
+        self.preallocated_size = None
+        self.digest = digest
 
-        file_clear_all_button.pack(side='right', padx=(0, PAD_MEDIUM))
+    @staticmethod
+    def get_temp_prefix(path):
+        return '.' + os.path.basename(path) + '.'
+
+    @classmethod
+    def find_temp_paths(cls, path):
+        """
+        Returns the temporary files left by writers for the given path, e.g.
+        by a download that was interrupted.
+        """
+        directory = os.path.dirname(path)
+        prefix = cls.get_temp_prefix(path)
+        try:
+            names = os.listdir(directory or '.')
+        except OSError:
+            return []
+
+        # the rest of the name is the random part added by mkstemp
+        return [
+            os.path.join(directory, name) for name in names
+            if name.startswith(prefix)
+            and name.endswith(PARTIAL_FILE_SUFFIX)
+            and '.' not in name[len(prefix):-len(PARTIAL_FILE_SUFFIX)]
+        ]
+
+    def preallocate(self, size):
+        if _posix_fallocate is None or size <= 0:
+            return
 
-        # Select all button
-        file_select_all_button = ttk.Button(
-            top_frame,
-            text='Select All',
-            command=self.select_all_files
-        )
+        # fallocate failing (e.g. unsupported by the filesystem) is harmless
+        if _posix_fallocate(self.file.fileno(), 0, size) == 0:
+            self.preallocated_size = size
 
-        file_select_all_button.pack(side='right', padx=(0, PAD_MEDIUM))
+    def write(self, data):
+        self.file.write(data)
+        if self.digest is not None:
+            self.digest.update(data)
 
-        # middle frames hold the FCS filters, download options, & file list
-        middle_left_frame = Tkinter.Frame(
-            middle_frame,
-            bg=BACKGROUND_COLOR
-        )
-        middle_left_frame.pack(
-            fill='both',
-            expand=False,
-            side='left',
-            padx=PAD_MEDIUM,
-            pady=PAD_MEDIUM
-        )
+    def flush(self):
+        self.file.flush()
 
-        middle_right_frame = Tkinter.Frame(
-            middle_frame,
-            bg=BACKGROUND_COLOR
-        )
-        middle_right_frame.pack(
-            fill='both',
-            expand=True,
-            side='right',
-            padx=PAD_MEDIUM,
-            pady=PAD_MEDIUM
-        )
+    def tell(self):
+        return self.file.tell()
 
-        # Metadata label frame - wrapper for metadata frame to allow padding
-        # seems internal padding doesn't work?
-        metadata_label_frame = Tkinter.LabelFrame(
-            middle_left_frame,
-            bg=BACKGROUND_COLOR
-        )
-        metadata_label_frame.pack(
-            fill='x',
-            expand=False,
-            anchor='n',
-            pady=(0, PAD_LARGE)
-        )
-        metadata_label_frame.config(text="FCS Sample Filters")
+    def seek(self, offset, whence=0):
+        self.file.seek(offset, whence)
 
-        # Metadata frame - for choosing project/subject/site etc.
-        metadata_frame = Tkinter.Frame(
-            metadata_label_frame,
-            bg=BACKGROUND_COLOR
-        )
-        metadata_frame.pack(
-            fill='x',
-            expand=False,
-            anchor='n',
-            padx=PAD_MEDIUM,
-            pady=PAD_MEDIUM
-        )
+    def truncate(self, size=None):
+        if size is None:
+            self.file.truncate()
+        else:
+            self.file.truncate(size)
+
+    def close(self):
+        # drop any preallocated space past the data actually written
+        if self.preallocated_size is not None:
+            self.file.truncate(self.file.tell())
+        self.file.close()
+        os.chmod(self.temp_path, 0o666 & ~_umask)
+
+        # rename won't replace an existing file on Windows
+        if sys.platform == 'win32' and os.path.isfile(self.path):
+            os.remove(self.path)
+        os.rename(self.temp_path, self.path)
+
+    def discard(self):
+        self.file.close()
+        if os.path.isfile(self.temp_path):
+            os.remove(self.temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def sync_files(paths):
+    """
+    Flushes the given files, and the directories holding them, to disk.
+    Called once per batch instead of syncing every file as it is written.
+    """
+    if sys.platform == 'win32':
+        # Windows can only flush files opened for writing
+        flags = os.O_RDWR
+    else:
+        flags = os.O_RDONLY
+
+    directories = set()
+    for path in paths:
+        try:
+            fd = os.open(path, flags)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except OSError:
+            continue
+        directories.add(os.path.dirname(path))
+
+    if sys.platform == 'win32':
+        return
+
+    # sync the directory entries for the renamed files
+    for directory in directories:
+        try:
+            fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except OSError:
+            pass
 
-        # Download options frame
-        download_options_frame = Tkinter.LabelFrame(
-            middle_left_frame,
-            bg=BACKGROUND_COLOR
-        )
-        download_options_frame.pack(
-            fill='both',
-            expand=True,
-            anchor='n'
-        )
-        download_options_frame.config(text="Download Options")
 
-        # Download options
-        download_dir_label_frame = Tkinter.Frame(
-            download_options_frame,
-            bg=BACKGROUND_COLOR
-        )
-        download_parent_dir_label = Tkinter.Label(
-            download_dir_label_frame,
-            text='Download Parent Folder: ',
-            bg=BACKGROUND_COLOR,
-            width=28,
-            anchor=Tkinter.W
-        )
-        download_parent_dir_label.pack(side='left')
-        download_dir_label_frame.pack(
-            padx=PAD_LARGE,
-            pady=(PAD_LARGE, 0),
-            fill='x'
-        )
+class ArchiveMember(object):
+    """
+    File-like object for streaming one sample into an ArchiveWriter. The
+    member's header is written up front & rewritten with the final size
+    once the data is complete, so no temporary copy is needed.
+    """
+    def __init__(self, archive, name):
+        self.archive = archive
+        self.name = name
+        self.size = 0
+        self.offset = archive.archive_fh.tell()
+
+        if archive.archive_format == 'zip':
+            self.zip_info = zipfile.ZipInfo(
+                name,
+                date_time=time.localtime(time.time())[:6]
+            )
+            self.zip_info.compress_type = zipfile.ZIP_DEFLATED
+            self.zip_info.external_attr = 0644 << 16L
+            self.zip_info.header_offset = self.offset
+            self.zip_info.CRC = 0
+            self.zip_info.compress_size = 0
+            self.zip_info.file_size = 0
+            self.compressor = zlib.compressobj(
+                zlib.Z_DEFAULT_COMPRESSION,
+                zlib.DEFLATED,
+                -zlib.MAX_WBITS
+            )
+        else:
+            self.tar_info = tarfile.TarInfo(name)
+            self.tar_info.mtime = time.time()
+            self.tar_info.mode = 0644
 
-        download_dir_entry_frame = Tkinter.Frame(
-            download_options_frame,
-            bg=BACKGROUND_COLOR
-        )
-        download_parent_dir_entry = Tkinter.Entry(
-            download_dir_entry_frame,
-            textvariable=self.download_parent_dir,
-            highlightbackground=BACKGROUND_COLOR,
-            width=42
-        )
-        download_parent_dir_entry.pack(padx=PAD_SMALL, side='left')
-        choose_download_parent_dir_button = ttk.Button(
-            download_dir_entry_frame,
-            text='Change Folder',
-            command=self.choose_download_parent_dir
-        )
-        choose_download_parent_dir_button.pack(side='left')
-        download_dir_entry_frame.pack(
-            padx=PAD_LARGE,
-            pady=PAD_SMALL,
-            fill='x'
+        self._write_header()
+
+    def _write_header(self):
+        # zip64 & GNU tar headers have a fixed length whatever the size,
+        # so they can be rewritten in place
+        if self.archive.archive_format == 'zip':
+            header = self.zip_info.FileHeader(zip64=True)
+        else:
+            self.tar_info.size = self.size
+            header = self.tar_info.tobuf(tarfile.GNU_FORMAT, 'utf-8')
+        self.archive.archive_fh.write(header)
+
+    def write(self, data):
+        self.size += len(data)
+
+        if self.archive.archive_format == 'zip':
+            self.zip_info.CRC = (
+                zlib.crc32(data, self.zip_info.CRC) & 0xffffffff
+            )
+            data = self.compressor.compress(data)
+            self.zip_info.compress_size += len(data)
+
+        self.archive.archive_fh.write(data)
+
+    def close(self):
+        archive_fh = self.archive.archive_fh
+
+        if self.archive.archive_format == 'zip':
+            data = self.compressor.flush()
+            self.zip_info.compress_size += len(data)
+            self.zip_info.file_size = self.size
+            archive_fh.write(data)
+        else:
+            remainder = self.size % tarfile.BLOCKSIZE
+            if remainder > 0:
+                archive_fh.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+
+        end = archive_fh.tell()
+        archive_fh.seek(self.offset)
+        self._write_header()
+        archive_fh.seek(end)
+
+        if self.archive.archive_format == 'zip':
+            self.archive.zip_file.filelist.append(self.zip_info)
+            self.archive.zip_file.NameToInfo[self.name] = self.zip_info
+
+    def discard(self):
+        # drop a partially written member
+        self.archive.archive_fh.seek(self.offset)
+        self.archive.archive_fh.truncate()
+
+
+class ArchiveWriter(object):
+    """
+    Streams downloaded samples into a single tar or zip archive, keeping
+    the download folder structure as the member paths. An index of every
+    member is added as the last member when the archive is closed.
+
+    Members are written one at a time, workers wait on the lock for their
+    turn.
+    """
+    def __init__(self, path, archive_format):
+        self.path = path
+        self.archive_format = archive_format
+        self.lock = threading.Lock()
+        self.index = []
+        self.member_names = set()
+
+        # the archive only gets its final name once it's complete
+        self.archive_fh = AtomicFileWriter(path)
+
+        if archive_format == 'zip':
+            self.zip_file = zipfile.ZipFile(
+                self.archive_fh,
+                'w',
+                zipfile.ZIP_DEFLATED,
+                allowZip64=True
+            )
+        else:
+            self.zip_file = None
+
+    def write_sample(self, job, write_function):
+        """
+        Calls write_function with a file-like member for the given job.
+        """
+        with self.lock:
+            # tar & zip both allow duplicate members, but only one of them
+            # is ever extracted
+            if job.path in self.member_names:
+                raise IOError('Duplicate archive member %s' % job.path)
+            self.member_names.add(job.path)
+
+            member = ArchiveMember(self, job.path)
+            try:
+                write_function(member)
+            except:
+                member.discard()
+                raise
+            member.close()
+
+            self.index.append(
+                [
+                    member.name,
+                    job.sample_metadata['id'],
+                    job.version,
+                    member.size,
+                    '' if job.clean else job.sample_metadata['sha1']
+                ]
+            )
+
+    def close(self):
+        index_fh = StringIO.StringIO()
+        index_writer = csv.writer(index_fh)
+        index_writer.writerow(['path', 'sample_id', 'version', 'size', 'sha1'])
+        for row in self.index:
+            index_writer.writerow(
+                [unicode(value).encode('utf-8') for value in row]
+            )
+
+        with self.lock:
+            if self.archive_format == 'zip':
+                self.zip_file.writestr(ARCHIVE_INDEX_NAME, index_fh.getvalue())
+                self.zip_file.close()
+                self.archive_fh.close()
+            else:
+                member = ArchiveMember(self, ARCHIVE_INDEX_NAME)
+                member.write(index_fh.getvalue())
+                member.close()
+
+                # end of archive marker, padded to a full record
+                self.archive_fh.write(tarfile.NUL * (tarfile.BLOCKSIZE * 2))
+                remainder = self.archive_fh.tell() % tarfile.RECORDSIZE
+                if remainder > 0:
+                    self.archive_fh.write(
+                        tarfile.NUL * (tarfile.RECORDSIZE - remainder)
+                    )
+                self.archive_fh.close()
+
+
+class TransferTask(object):
+    """
+    A blocking call queued on a TransferPool. The callback (or errback) is
+    run on the Tk thread once the call has finished, unless the task was
+    cancelled.
+    """
+    def __init__(self, func, args, kwargs, callback, errback):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.callback = callback
+        self.errback = errback
+
+        self.result = None
+        self.error = None
+        self.cancelled = False
+
+    def cancel(self):
+        # a queued task is skipped by the workers, the result of a running
+        # task is dropped when it finishes
+        self.cancelled = True
+
+
+class TransferPool(object):
+    """
+    Runs blocking REST calls on a fixed number of worker threads.
+
+    Tk widgets may only be touched from the Tk thread, so finished tasks are
+    queued and their callbacks are run by poll(), which the application
+    calls periodically from the Tk event loop using after(). The number of
+    OS threads stays fixed however many requests are queued.
+
+    Tasks are started in the order they are submitted, except that low
+    priority tasks (e.g. background lookups) wait for all the others.
+    """
+    def __init__(self, worker_count=TRANSFER_WORKER_COUNT):
+        # entries are (priority, submission count, task)
+        self.task_queue = Queue.PriorityQueue()
+        self.done_queue = Queue.Queue()
+        self.submitted_count = 0
+
+        self.workers = []
+        for i in range(worker_count):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(
+            self,
+            func,
+            args=(),
+            kwargs=None,
+            callback=None,
+            errback=None,
+            low_priority=False
+    ):
+        task = TransferTask(func, args, kwargs or {}, callback, errback)
+
+        # only called from the Tk thread, the count needs no lock
+        self.submitted_count += 1
+        self.task_queue.put((int(low_priority), self.submitted_count, task))
+
+        return task
+
+    def _work(self):
+        while True:
+            priority, submitted_count, task = self.task_queue.get()
+            if task.cancelled:
+                continue
+
+            # noinspection PyBroadException
+            try:
+                task.result = task.func(*task.args, **task.kwargs)
+            except Exception, e:
+                task.error = e
+
+            self.done_queue.put(task)
+
+    def poll(self):
+        """
+        Runs the callbacks of all finished tasks, must be called from the
+        Tk thread.
+        """
+        while True:
+            try:
+                task = self.done_queue.get_nowait()
+            except Queue.Empty:
+                return
+
+            if task.cancelled:
+                continue
+
+            # a failing callback is reported, it mustn't stop the results
+            # of the other tasks from being delivered
+            # noinspection PyBroadException
+            try:
+                if task.error is not None:
+                    if task.errback is not None:
+                        task.errback(task.error)
+                    else:
+                        print task.error
+                elif task.callback is not None:
+                    task.callback(task.result)
+            except Exception:
+                traceback.print_exc()
+
+
+def write_sample_metadata(base_path, jobs, paths):
+    """
+    Writes one table describing every file in the given jobs to
+    <base_path>.csv & <base_path>.jsonl, plus <base_path>.parquet if pyarrow
+    is installed and there are files. Each file is appended to the paths
+    list as soon as it's written, so it is known even if a later one fails.
+    """
+    columns = [column for column, field in SAMPLE_METADATA_COLUMNS]
+    columns.extend(['version', 'path'])
+
+    rows = []
+    for job in jobs:
+        row = [
+            job.sample_metadata.get(field)
+            for column, field in SAMPLE_METADATA_COLUMNS
+        ]
+        if job.clean:
+            # clean files have no checksum on the server
+            row[columns.index('sha1')] = None
+        row.extend([job.version, job.path])
+        rows.append(row)
+
+    csv_path = base_path + '.csv'
+    with open(csv_path, 'wb') as csv_fh:
+        csv_writer = csv.writer(csv_fh)
+        csv_writer.writerow(columns)
+        csv_writer.writerows(
+            [
+                [
+                    '' if value is None else unicode(value).encode('utf-8')
+                    for value in row
+                ] for row in rows
+            ]
         )
+    paths.append(csv_path)
 
-        download_structure_label_frame = Tkinter.Frame(
-            download_options_frame,
-            bg=BACKGROUND_COLOR
+    json_path = base_path + '.jsonl'
+    with open(json_path, 'w') as json_fh:
+        json_fh.writelines(
+            [json.dumps(dict(zip(columns, row))) + '\n' for row in rows]
         )
-        download_structure_label = Tkinter.Label(
-            download_structure_label_frame,
-            text='Choose download folder structure: ',
-            bg=BACKGROUND_COLOR,
-            width=28,
-            anchor=Tkinter.W
+    paths.append(json_path)
+
+    # pyarrow can't build a table from no columns
+    if pyarrow is not None and rows:
+        parquet_path = base_path + '.parquet'
+        table = pyarrow.Table.from_arrays(
+            [pyarrow.array(list(values)) for values in zip(*rows)],
+            names=columns
         )
-        download_structure_label.pack(side='left')
-        download_structure_label_frame.pack(
-            padx=PAD_LARGE,
-            pady=(PAD_LARGE, 0),
-            fill='x'
+        pyarrow.parquet.write_table(table, parquet_path)
+        paths.append(parquet_path)
+
+
+class DownloadBatch(object):
+    """
+    Tracks the jobs of a running download along with its journal, the
+    verifier checking existing files and the archive (if any) the samples
+    are written to.
+    """
+    def __init__(
+            self,
+            jobs,
+            journal,
+            verifier,
+            archive=None,
+            metadata_path=None,
+            finish_callback=None,
+            conflict_policy='skip',
+            show_report=True
+    ):
+        self.jobs = jobs
+        self.journal = journal
+        self.verifier = verifier
+        self.archive = archive
+        self.finished_count = 0
+        self.is_closed = False
+
+        # how existing files that can't be verified are handled (skip,
+        # overwrite or rename) & the problems reported when the batch ends
+        self.conflict_policy = conflict_policy
+        self.warnings = []
+        self.show_report = show_report
+
+        # entries of each target directory, listed once when the batch
+        # starts (None for a directory that doesn't exist yet)
+        self.local_files = {}
+
+        # fingerprints of clean files written by earlier batches by path
+        self.clean_fingerprints = {}
+        self.sample_dirs = set([job.sample_dir for job in jobs])
+
+        # paths already taken by a job of the batch, a later job for the
+        # same path (e.g. samples with the same file name in a flat
+        # layout) is a conflict rather than a second writer
+        self.claimed_paths = set()
+
+        # used to measure the throughput of the batch
+        self.start_time = time.time()
+        self.start_bytes_written = None
+
+        # base path of the metadata table written when the batch finishes
+        self.metadata_path = metadata_path
+
+        # called with the batch once every job is finished
+        self.finish_callback = finish_callback
+
+        for i, job in enumerate(jobs):
+            job.order = i
+
+        # files waiting for a download slot (a priority queue for each
+        # version) & downloads in flight per host and version
+        self.pending_jobs = {
+            'original': [],
+            'clean': []
+        }
+        self.active_jobs = []
+        self.host_downloads = collections.defaultdict(int)
+
+        # while paused no new downloads are started
+        self.paused = False
+        self.smallest_first = False
+
+    @property
+    def is_finished(self):
+        return self.finished_count >= len(self.jobs)
+
+    def get_local_file(self, job):
+        """
+        Returns the (is_file, size, modification time) of the existing file
+        at the job's path, or None if there is no such file.
+        """
+        entries = self.local_files.get(job.sample_dir)
+        if entries is None:
+            return None
+        return entries.get(job.file_name)
+
+    def get_priority(self, job):
+        # pinned jobs first, then smallest first (unknown sizes last) or
+        # in selection order
+        if not self.smallest_first:
+            size = 0
+        elif job.expected_size is None:
+            size = sys.maxint
+        else:
+            size = job.expected_size
+
+        return 0 if job.pinned else 1, size, job.order
+
+    def add_pending(self, job):
+        heapq.heappush(
+            self.pending_jobs[job.version],
+            (self.get_priority(job), job)
         )
-        download_structure_options_frame = Tkinter.Frame(
-            download_options_frame,
-            bg=BACKGROUND_COLOR
+
+    def pop_pending(self, version):
+        # cancelled jobs are dropped as they come up
+        pending_jobs = self.pending_jobs[version]
+        while pending_jobs:
+            priority, job = heapq.heappop(pending_jobs)
+            if not job.cancel_event.is_set():
+                return job
+
+        return None
+
+    def reorder(self):
+        for version, pending_jobs in self.pending_jobs.items():
+            pending_jobs = [
+                (self.get_priority(job), job) for priority, job in pending_jobs
+                if not job.cancel_event.is_set()
+            ]
+            heapq.heapify(pending_jobs)
+            self.pending_jobs[version] = pending_jobs
+
+    def get_queued_jobs(self):
+        """
+        Returns the jobs in flight followed by the pending jobs in the order
+        they will be downloaded.
+        """
+        pending_jobs = []
+        for version_jobs in self.pending_jobs.values():
+            pending_jobs.extend(version_jobs)
+        pending_jobs.sort()
+
+        return self.active_jobs + [
+            job for priority, job in pending_jobs
+            if not job.cancel_event.is_set()
+        ]
+
+
+class DownloadJournal(object):
+    """
+    Append-only record of a download batch, one JSON object per line.
+
+    The first line lists every job in the batch, each following line records
+    the state of a single job. Appending a short line per job keeps the
+    journal cheap to maintain, and a line truncated by a crash is ignored
+    when the journal is loaded.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.journal_fh = None
+
+    def start(self, host, jobs):
+        if self.path is None:
+            # journaling is disabled for this batch
+            return
+
+        # noinspection PyBroadException
+        try:
+            self.journal_fh = open(self.path, 'w')
+        except Exception:
+            # well, we tried, but don't stop the download
+            self.journal_fh = None
+            return
+
+        self._write(
+            {
+                'host': host,
+                'jobs': [job.to_dict() for job in jobs]
+            }
         )
-        for text, value in download_structure_options:
-            dl_radio_button = Tkinter.Radiobutton(
-                download_structure_options_frame,
-                text=text,
-                variable=self.download_structure,
-                value=value,
+
+    def mark(self, job, state):
+        # the file name changes when a conflicting file is saved under a
+        # new name. The fingerprint of a clean file is kept with it, so
+        # it's not lost if the batch is interrupted before it's saved.
+        entry = {
+            'key': job.key,
+            'state': state,
+            'file_name': job.file_name
+        }
+        if state == 'downloaded' and job.fingerprint is not None:
+            entry['fingerprint'] = job.fingerprint
+        self._write(entry)
+
+    def _write(self, entry):
+        if self.journal_fh is None:
+            return
+
+        # noinspection PyBroadException
+        try:
+            self.journal_fh.write(json.dumps(entry) + '\n')
+            self.journal_fh.flush()
+        except Exception:
+            pass
+
+    def close(self, remove=False):
+        if self.journal_fh is not None:
+            self.journal_fh.close()
+            self.journal_fh = None
+
+        if remove and self.path is not None:
+            self.discard(self.path)
+
+    @staticmethod
+    def discard(path):
+        if os.path.isfile(path):
+            os.remove(path)
+
+    @staticmethod
+    def load(path):
+        """
+        Returns the host, the list of unfinished jobs & the fingerprints of
+        the clean files written (by absolute path) recorded in the journal
+        at the given path, or (None, [], {}) if there is no journal.
+        """
+        # noinspection PyBroadException
+        try:
+            journal_fh = open(path, 'r')
+        except Exception:
+            return None, [], {}
+
+        fingerprints = {}
+        with journal_fh:
+            try:
+                header = json.loads(journal_fh.readline())
+            except ValueError:
+                return None, [], {}
+
+            jobs = [DownloadJob.from_dict(j) for j in header['jobs']]
+            jobs_by_key = dict([(job.key, job) for job in jobs])
+
+            for line in journal_fh:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # partial line written during a crash
+                    continue
+                if entry['key'] in jobs_by_key:
+                    job = jobs_by_key[entry['key']]
+                    job.state = entry['state']
+                    job.file_name = entry.get('file_name', job.file_name)
+                    if 'fingerprint' in entry:
+                        fingerprints[os.path.abspath(job.path)] = entry[
+                            'fingerprint'
+                        ]
+
+        remaining = [
+            job for job in jobs if job.state in [None, 'started', 'error']
+        ]
+
+        return header['host'], remaining, fingerprints
+
+
+class Application(Tkinter.Frame):
+
+    def __init__(self, master):
+
+        # check for previously used host & username for this user
+        user_settings = load_user_settings()
+        self.host = user_settings.get('host')
+        self.username = user_settings.get('username')
+        if self.host is not None:
+            self.host = get_host_name(self.host)
+
+        # the login token is only saved if the user asked for it
+        self.remember_login = Tkinter.IntVar()
+        self.remember_login.set(user_settings.get('remember_login', 0))
+
+        # download throughput (bytes/second) measured in the last batch,
+        # used to estimate how long a download will take
+        self.throughput = user_settings.get('throughput')
+
+        # saved filter profiles, the watched ones are polled for new
+        # samples which are downloaded automatically
+        self.filter_profiles = load_json_file(filter_profiles_path)
+        self.watched_profiles = set(user_settings.get('watched_profiles', []))
+        self.watch_after_id = None
+        self.watch_profile_vars = {}
+
+        # newly watched profiles whose current matches are recorded as
+        # fetched (rather than downloaded) by their next poll
+        self.seeding_profiles = set()
+        self.profile_menu = None
+
+        # pks of the filter menus still to be restored from an applied
+        # profile by selection name, filters wait until all are restored
+        self.profile_selections = {}
+        self.profile_query = None
+        self.profile_query_name = None
+
+        # The password is never saved, the token only when the user opts
+        # in (see save_cached_token)
+        self.token = None
+        if self.remember_login.get() and self.host and self.username:
+            self.token = load_cached_token(self.host, self.username)
+
+        # projects listed at the last login, shown while the list is
+        # refreshed when starting with a saved token
+        self.cached_projects = user_settings.get('projects', [])
+
+        # Using the names (project, site, etc.) as the key, pk as the value
+        # for the choice dictionaries below.
+        # The names need to be unique (and they should be) and
+        # it's more convenient to lookup by key using the name.
+        self.project_dict = dict()
+        self.site_dict = dict()
+        self.subject_dict = dict()
+        self.visit_dict = dict()
+        self.panel_template_dict = dict()
+        self.stimulation_dict = dict()
+
+        # start the metadata menus
+        self.project_menu = None
+        self.project_selection = Tkinter.StringVar()
+        self.project_selection.trace("w", self.update_metadata)
+
+        self.site_menu = None
+        self.site_selection = Tkinter.StringVar()
+
+        self.subject_menu = None
+        self.subject_selection = Tkinter.StringVar()
+
+        self.visit_menu = None
+        self.visit_selection = Tkinter.StringVar()
+
+        self.stimulation_menu = None
+        self.stimulation_selection = Tkinter.StringVar()
+
+        self.panel_template_menu = None
+        self.panel_template_selection = Tkinter.StringVar()
+
+        # filters are applied automatically once the selections settle
+        self.apply_filters_after_id = None
+        self.sample_query = None
+
+        # each project's full sample list is prefetched when the project
+        # is chosen, keyed by project ID
+        self.project_samples = dict()
+        self.sample_prefetch = None
+        self.sample_prefetch_project_id = None
+        self.apply_filters_after_prefetch = False
+        for selection in [
+            self.project_selection,
+            self.site_selection,
+            self.subject_selection,
+            self.visit_selection,
+            self.panel_template_selection,
+            self.stimulation_selection
+        ]:
+            selection.trace("w", self.schedule_apply_filters)
+
+        # download options
+        self.download_parent_dir = Tkinter.StringVar()
+        self.download_parent_dir.set(default_download_parent_dir)
+        self.download_structure = Tkinter.StringVar()
+        # default output structure is 'flat'
+        self.download_structure.set('flat')
+        # download version to specify downloading of original or clean
+        # FCS samples (or both)
+        self.download_version = Tkinter.StringVar()
+        self.download_version.set('clean')
+        # save samples as individual files or stream them into one archive
+        self.download_output = Tkinter.StringVar()
+        self.download_output.set('folder')
+        # how to handle existing files that differ from the server's
+        self.conflict_policy = Tkinter.StringVar()
+        self.conflict_policy.set('skip')
+
+        # can't call super on old-style class, call parent init directly
+        Tkinter.Frame.__init__(self, master)
+        if sys.platform == 'linux2':
+            pass
+        else:
+            self.master.iconbitmap(ICON_PATH)
+        self.master.title('ReFlow Download Client - ' + VERSION)
+        self.master.minsize(width=WINDOW_WIDTH, height=WINDOW_HEIGHT)
+        self.master.config(bg=BACKGROUND_COLOR)
+
+        self.menu_bar = Tkinter.Menu(master)
+        self.master.config(menu=self.menu_bar)
+
+        self.download_progress_bar = None
+        self.file_list_canvas = None
+
+        # sample check boxes in display order, their lower case file names
+        # & the search index over them (built on a worker thread whenever
+        # the list changes)
+        self.file_list_checkbuttons = []
+        self.sample_names = []
+        self.sample_index = None
+        self.sample_index_task = None
+        self.search_text = Tkinter.StringVar()
+        self.search_text.trace("w", self.schedule_search)
+        self.search_after_id = None
+
+        # blocking REST calls run on worker threads, their results are
+        # picked up by the Tk event loop in poll_transfer_pool
+        self.transfer_pool = TransferPool()
+        self.download_batch = None
+
+        # download queue window, listing the jobs of the running batch
+        self.queue_window = None
+        self.queue_listbox = None
+        self.queue_listbox_jobs = []
+        self.queue_pause_button = None
+        self.queue_smallest_first = Tkinter.IntVar()
+        self.queue_changed = False
+        self.queue_refresh_time = 0
+
+        # samples queued for download from other projects or filter sets,
+        # downloaded together with the current selection as one batch
+        self.queued_samples = collections.OrderedDict()
+        self.queued_samples_label = None
+
+        # session totals for downloads, shown below the progress bar
+        self.transfer_stats = TransferStats()
+        self.transfer_stats_label = None
+
+        # last repaint of the progress bar & stats label
+        self.progress_refresh_time = 0
+        self.progress_drawn_count = 0
+
+        self.s = ttk.Style()
+        self.s.map(
+            'Inactive.TButton',
+            foreground=[('disabled', INACTIVE_FOREGROUND_COLOR)])
+
+        self.pack()
+
+        self.main_frame = None
+        self.main_frame_pack_info = None
+
+        self.login_frame = Tkinter.Frame(bg=BACKGROUND_COLOR)
+        self.logo_image = ImageTk.PhotoImage(Image.open(LOGO_PATH))
+        if self.token is None:
+            self.load_login_frame()
+        else:
+            # straight to the main frame with the saved token, the token
+            # is checked when the project list loads
+            self.load_main_frame()
+            self.populate_project_menu({'data': self.cached_projects})
+
+        self.poll_transfer_pool()
+
+    def load_login_frame(self):
+        # noinspection PyUnusedLocal
+        def login(*args):
+            host_text = host_entry.get()
+            self.username = user_entry.get()
+            password = password_entry.get()
+
+            try:
+                self.host = get_host_name(host_text)
+                self.token = rest.get_token(self.host, self.username, password)
+            except Exception, e:
+                print e
+            if not self.token:
+                tkMessageBox.showwarning(
+                    'Login Failed',
+                    'Are the hostname, username, and password are correct?'
+                )
+                return
+
+            if self.token is not None:
+                # if we get here, user was authenticated,
+                # cache the host/username
+                save_user_settings(
+                    host=host_text,
+                    username=self.username,
+                    remember_login=self.remember_login.get()
+                )
+                if self.remember_login.get():
+                    save_cached_token(self.host, self.username, self.token)
+                else:
+                    discard_cached_token(self.host, self.username)
+
+            self.login_frame.destroy()
+            self.master.unbind('<Return>')
+
+            if self.main_frame is None:
+                self.load_main_frame()
+            else:
+                # logging in again after the saved token was rejected
+                self.main_frame.pack(**self.main_frame_pack_info)
+                self.load_user_projects()
+
+        self.master.bind('<Return>', login)
+
+        logo_label = Tkinter.Label(self.login_frame, image=self.logo_image)
+        logo_label.config(bg=BACKGROUND_COLOR)
+        logo_label.pack(side='top', pady=PAD_EXTRA_LARGE)
+
+        host_entry_frame = Tkinter.Frame(self.login_frame, bg=BACKGROUND_COLOR)
+        host_label = Tkinter.Label(
+            host_entry_frame,
+            text='Hostname',
+            bg=BACKGROUND_COLOR,
+            width=8,
+            anchor='e'
+        )
+        host_label.pack(side='left')
+        host_entry = Tkinter.Entry(
+            host_entry_frame,
+            highlightbackground=BACKGROUND_COLOR,
+            width=24
+        )
+        if self.host is not None:
+            host_entry.insert(Tkinter.END, self.host)
+        host_entry.pack(padx=PAD_SMALL)
+        host_entry_frame.pack(pady=PAD_SMALL)
+
+        user_entry_frame = Tkinter.Frame(self.login_frame, bg=BACKGROUND_COLOR)
+        user_label = Tkinter.Label(
+            user_entry_frame,
+            text='Username',
+            bg=BACKGROUND_COLOR,
+            width=8,
+            anchor='e'
+        )
+        user_label.pack(side='left')
+        user_entry = Tkinter.Entry(
+            user_entry_frame,
+            highlightbackground=BACKGROUND_COLOR,
+            width=24
+        )
+        if self.username is not None:
+            user_entry.insert(Tkinter.END, self.username)
+        user_entry.pack(padx=PAD_SMALL)
+        user_entry_frame.pack(pady=PAD_SMALL)
+
+        password_entry_frame = Tkinter.Frame(
+            self.login_frame,
+            bg=BACKGROUND_COLOR
+        )
+        password_label = Tkinter.Label(
+            password_entry_frame,
+            text='Password',
+            bg=BACKGROUND_COLOR,
+            width=8,
+            anchor='e'
+        )
+        password_label.pack(side='left')
+        password_entry = Tkinter.Entry(
+            password_entry_frame,
+            show='*',
+            highlightbackground=BACKGROUND_COLOR,
+            width=24
+        )
+        password_entry.pack(padx=PAD_SMALL)
+        password_entry_frame.pack(pady=PAD_SMALL)
+
+        remember_login_checkbutton = Tkinter.Checkbutton(
+            self.login_frame,
+            text='Keep me logged in',
+            variable=self.remember_login,
+            bg=BACKGROUND_COLOR,
+            highlightthickness=0
+        )
+        remember_login_checkbutton.pack(pady=PAD_SMALL)
+
+        login_button_frame = Tkinter.Frame(
+            self.login_frame,
+            bg=BACKGROUND_COLOR
+        )
+        login_button_label = Tkinter.Label(
+            login_button_frame,
+            bg=BACKGROUND_COLOR
+        )
+        login_button = ttk.Button(
+            login_button_label,
+            text='Login',
+            command=login
+        )
+        login_button.pack()
+        login_button_label.pack(side='right')
+        login_button_frame.pack(fill='x')
+
+        self.login_frame.place(in_=self.master, anchor='c', relx=.5, rely=.5)
+
+    def load_main_frame(self):
+        main_frame = Tkinter.Frame(self.master, bg=BACKGROUND_COLOR)
+        self.main_frame = main_frame
+        main_frame.pack(
+            fill='both',
+            expand=True,
+            anchor='n',
+            padx=PAD_MEDIUM,
+            pady=PAD_MEDIUM
+        )
+
+        top_frame = Tkinter.Frame(
+            main_frame,
+            bg=BACKGROUND_COLOR
+        )
+        top_frame.pack(
+            fill='x',
+            expand=False,
+            anchor='n',
+            padx=PAD_MEDIUM,
+            pady=PAD_MEDIUM
+        )
+
+        middle_frame = Tkinter.Frame(main_frame, bg=BACKGROUND_COLOR)
+        middle_frame.pack(
+            fill='both',
+            expand=True,
+            anchor='n'
+        )
+
+        bottom_frame = Tkinter.Frame(main_frame, bg=BACKGROUND_COLOR)
+        bottom_frame.pack(
+            fill='x',
+            expand=False,
+            anchor='n',
+            padx=PAD_MEDIUM,
+            pady=PAD_MEDIUM
+        )
+
+        # Action buttons all go in top frame
+        apply_filters_button = ttk.Button(
+            top_frame,
+            text='Apply Filters',
+            command=self.refresh_filters
+        )
+
+        apply_filters_button.pack(side='left')
+
+        download_selected_button = ttk.Button(
+            top_frame,
+            text='Download Selected',
+            command=self.download_selected
+        )
+
+        download_selected_button.pack(side='right')
+
+        # dry run button, reports the download plan without downloading
+        dry_run_button = ttk.Button(
+            top_frame,
+            text='Dry Run',
+            command=lambda: self.download_selected(dry_run=True)
+        )
+
+        dry_run_button.pack(side='right', padx=(0, PAD_MEDIUM))
+
+        # download queue button, to reorder, pause or cancel downloads
+        show_queue_button = ttk.Button(
+            top_frame,
+            text='Download Queue',
+            command=self.show_download_queue
+        )
+
+        show_queue_button.pack(side='right', padx=(0, PAD_MEDIUM))
+
+        # queue selection button & queue size
+        queue_selected_button = ttk.Button(
+            top_frame,
+            text='Queue Selected',
+            command=self.queue_selected
+        )
+
+        queue_selected_button.pack(side='right', padx=(0, PAD_MEDIUM))
+
+        self.queued_samples_label = Tkinter.Label(
+            top_frame,
+            bg=BACKGROUND_COLOR
+        )
+        self.queued_samples_label.pack(side='right', padx=(0, PAD_MEDIUM))
+
+        # Clear all button
+        file_clear_all_button = ttk.Button(
+            top_frame,
+            text='Clear All',
+            command=self.clear_all_files
+        )
+
+        file_clear_all_button.pack(side='right', padx=(0, PAD_MEDIUM))
+
+        # Select all button
+        file_select_all_button = ttk.Button(
+            top_frame,
+            text='Select All',
+            command=self.select_all_files
+        )
+
+        file_select_all_button.pack(side='right', padx=(0, PAD_MEDIUM))
+
+        # middle frames hold the FCS filters, download options, & file list
+        middle_left_frame = Tkinter.Frame(
+            middle_frame,
+            bg=BACKGROUND_COLOR
+        )
+        middle_left_frame.pack(
+            fill='both',
+            expand=False,
+            side='left',
+            padx=PAD_MEDIUM,
+            pady=PAD_MEDIUM
+        )
+
+        middle_right_frame = Tkinter.Frame(
+            middle_frame,
+            bg=BACKGROUND_COLOR
+        )
+        middle_right_frame.pack(
+            fill='both',
+            expand=True,
+            side='right',
+            padx=PAD_MEDIUM,
+            pady=PAD_MEDIUM
+        )
+
+        # Metadata label frame - wrapper for metadata frame to allow padding
+        # seems internal padding doesn't work?
+        metadata_label_frame = Tkinter.LabelFrame(
+            middle_left_frame,
+            bg=BACKGROUND_COLOR
+        )
+        metadata_label_frame.pack(
+            fill='x',
+            expand=False,
+            anchor='n',
+            pady=(0, PAD_LARGE)
+        )
+        metadata_label_frame.config(text="FCS Sample Filters")
+
+        # Metadata frame - for choosing project/subject/site etc.
+        metadata_frame = Tkinter.Frame(
+            metadata_label_frame,
+            bg=BACKGROUND_COLOR
+        )
+        metadata_frame.pack(
+            fill='x',
+            expand=False,
+            anchor='n',
+            padx=PAD_MEDIUM,
+            pady=PAD_MEDIUM
+        )
+
+        # Download options frame
+        download_options_frame = Tkinter.LabelFrame(
+            middle_left_frame,
+            bg=BACKGROUND_COLOR
+        )
+        download_options_frame.pack(
+            fill='both',
+            expand=True,
+            anchor='n'
+        )
+        download_options_frame.config(text="Download Options")
+
+        # Download options
+        download_dir_label_frame = Tkinter.Frame(
+            download_options_frame,
+            bg=BACKGROUND_COLOR
+        )
+        download_parent_dir_label = Tkinter.Label(
+            download_dir_label_frame,
+            text='Download Parent Folder: ',
+            bg=BACKGROUND_COLOR,
+            width=28,
+            anchor=Tkinter.W
+        )
+        download_parent_dir_label.pack(side='left')
+        download_dir_label_frame.pack(
+            padx=PAD_LARGE,
+            pady=(PAD_LARGE, 0),
+            fill='x'
+        )
+
+        download_dir_entry_frame = Tkinter.Frame(
+            download_options_frame,
+            bg=BACKGROUND_COLOR
+        )
+        download_parent_dir_entry = Tkinter.Entry(
+            download_dir_entry_frame,
+            textvariable=self.download_parent_dir,
+            highlightbackground=BACKGROUND_COLOR,
+            width=42
+        )
+        download_parent_dir_entry.pack(padx=PAD_SMALL, side='left')
+        choose_download_parent_dir_button = ttk.Button(
+            download_dir_entry_frame,
+            text='Change Folder',
+            command=self.choose_download_parent_dir
+        )
+        choose_download_parent_dir_button.pack(side='left')
+        download_dir_entry_frame.pack(
+            padx=PAD_LARGE,
+            pady=PAD_SMALL,
+            fill='x'
+        )
+
+        download_structure_label_frame = Tkinter.Frame(
+            download_options_frame,
+            bg=BACKGROUND_COLOR
+        )
+        download_structure_label = Tkinter.Label(
+            download_structure_label_frame,
+            text='Choose download folder structure: ',
+            bg=BACKGROUND_COLOR,
+            width=28,
+            anchor=Tkinter.W
+        )
+        download_structure_label.pack(side='left')
+        download_structure_label_frame.pack(
+            padx=PAD_LARGE,
+            pady=(PAD_LARGE, 0),
+            fill='x'
+        )
+        download_structure_options_frame = Tkinter.Frame(
+            download_options_frame,
+            bg=BACKGROUND_COLOR
+        )
+        for text, value in download_structure_options:
+            dl_radio_button = Tkinter.Radiobutton(
+                download_structure_options_frame,
+                text=text,
+                variable=self.download_structure,
+                value=value,
+                bg=BACKGROUND_COLOR,
+                highlightthickness=0
+            )
+            dl_radio_button.pack(anchor=Tkinter.W)
+        download_structure_options_frame.pack(
+            padx=PAD_LARGE,
+            pady=(PAD_LARGE, 0),
+            fill='x'
+        )
+
+        download_version_label_frame = Tkinter.Frame(
+            download_options_frame,
+            bg=BACKGROUND_COLOR
+        )
+        download_version_label = Tkinter.Label(
+            download_version_label_frame,
+            text='Choose file types to download:',
+            bg=BACKGROUND_COLOR,
+            width=32,
+            anchor=Tkinter.W
+        )
+        download_version_label.pack(side='left')
+        download_version_label_frame.pack(
+            padx=PAD_LARGE,
+            pady=(PAD_LARGE, 0),
+            fill='x'
+        )
+        download_version_options_frame = Tkinter.Frame(
+            download_options_frame,
+            bg=BACKGROUND_COLOR
+        )
+        for text, value in download_version_options:
+            dl_radio_button = Tkinter.Radiobutton(
+                download_version_options_frame,
+                text=text,
+                variable=self.download_version,
+                value=value,
+                bg=BACKGROUND_COLOR,
+                highlightthickness=0
+            )
+            dl_radio_button.pack(anchor=Tkinter.W)
+        download_version_options_frame.pack(
+            padx=PAD_LARGE,
+            pady=(PAD_LARGE, 0),
+            fill='x'
+        )
+
+        download_output_label_frame = Tkinter.Frame(
+            download_options_frame,
+            bg=BACKGROUND_COLOR
+        )
+        download_output_label = Tkinter.Label(
+            download_output_label_frame,
+            text='Save downloads as:',
+            bg=BACKGROUND_COLOR,
+            width=32,
+            anchor=Tkinter.W
+        )
+        download_output_label.pack(side='left')
+        download_output_label_frame.pack(
+            padx=PAD_LARGE,
+            pady=(PAD_LARGE, 0),
+            fill='x'
+        )
+        download_output_options_frame = Tkinter.Frame(
+            download_options_frame,
+            bg=BACKGROUND_COLOR
+        )
+        for text, value in download_output_options:
+            dl_radio_button = Tkinter.Radiobutton(
+                download_output_options_frame,
+                text=text,
+                variable=self.download_output,
+                value=value,
+                bg=BACKGROUND_COLOR,
+                highlightthickness=0
+            )
+            dl_radio_button.pack(anchor=Tkinter.W)
+        download_output_options_frame.pack(
+            padx=PAD_LARGE,
+            pady=(PAD_LARGE, 0),
+            fill='x'
+        )
+
+        conflict_policy_label_frame = Tkinter.Frame(
+            download_options_frame,
+            bg=BACKGROUND_COLOR
+        )
+        conflict_policy_label = Tkinter.Label(
+            conflict_policy_label_frame,
+            text='When a different file exists:',
+            bg=BACKGROUND_COLOR,
+            width=32,
+            anchor=Tkinter.W
+        )
+        conflict_policy_label.pack(side='left')
+        conflict_policy_label_frame.pack(
+            padx=PAD_LARGE,
+            pady=(PAD_LARGE, 0),
+            fill='x'
+        )
+        conflict_policy_options_frame = Tkinter.Frame(
+            download_options_frame,
+            bg=BACKGROUND_COLOR
+        )
+        for text, value in conflict_policy_options:
+            dl_radio_button = Tkinter.Radiobutton(
+                conflict_policy_options_frame,
+                text=text,
+                variable=self.conflict_policy,
+                value=value,
                 bg=BACKGROUND_COLOR,
                 highlightthickness=0
             )
-            dl_radio_button.pack(anchor=Tkinter.W)
-        download_structure_options_frame.pack(
-            padx=PAD_LARGE,
-            pady=(PAD_LARGE, 0),
-            fill='x'
+            dl_radio_button.pack(anchor=Tkinter.W)
+        conflict_policy_options_frame.pack(
+            padx=PAD_LARGE,
+            pady=(PAD_LARGE, 0),
+            fill='x'
+        )
+
+        # overall project frame
+        project_frame = Tkinter.Frame(
+            metadata_frame,
+            bg=BACKGROUND_COLOR
+        )
+
+        # project label frame
+        project_chooser_label_frame = Tkinter.Frame(
+            project_frame,
+            bg=BACKGROUND_COLOR)
+        project_chooser_label = Tkinter.Label(
+            project_chooser_label_frame,
+            text='Project:',
+            bg=BACKGROUND_COLOR,
+            width=LABEL_WIDTH,
+            anchor=Tkinter.E
+        )
+        project_chooser_label.pack(side='left')
+        project_chooser_label_frame.pack(side='left', fill='x')
+
+        # project chooser listbox frame
+        project_chooser_frame = Tkinter.Frame(
+            project_frame,
+            bg=BACKGROUND_COLOR)
+        self.project_menu = Tkinter.OptionMenu(
+            project_chooser_frame,
+            self.project_selection,
+            ''
+        )
+        self.project_menu.config(
+            bg=BACKGROUND_COLOR,
+            width=28
+        )
+        self.project_menu.pack(fill='x', expand=True, side='left')
+        clear_project_filter_button = ttk.Button(
+            project_chooser_frame,
+            text='Clear',
+            command=self.clear_project_filter
+        )
+        clear_project_filter_button.pack(side='left')
+        project_chooser_frame.pack(fill='x', expand=True)
+
+        project_frame.pack(
+            side='top',
+            fill='x',
+            expand=True,
+            padx=PAD_MEDIUM,
+            pady=PAD_SMALL
+        )
+
+        # overall site frame
+        site_frame = Tkinter.Frame(metadata_frame, bg=BACKGROUND_COLOR)
+
+        # site label frame
+        site_chooser_label_frame = Tkinter.Frame(
+            site_frame,
+            bg=BACKGROUND_COLOR
+        )
+        site_chooser_label = Tkinter.Label(
+            site_chooser_label_frame,
+            text='Site:',
+            bg=BACKGROUND_COLOR,
+            width=LABEL_WIDTH,
+            anchor=Tkinter.E
+        )
+        site_chooser_label.pack(side='left')
+        site_chooser_label_frame.pack(side='left', fill='x')
+
+        # site chooser listbox frame
+        site_chooser_frame = Tkinter.Frame(
+            site_frame,
+            bg=BACKGROUND_COLOR
+        )
+        self.site_menu = FilterCombobox(
+            site_chooser_frame,
+            self.site_selection
+        )
+        self.site_menu.pack(fill='x', expand=True, side='left')
+        clear_site_filter_button = ttk.Button(
+            site_chooser_frame,
+            text='Clear',
+            command=self.clear_site_filter
+        )
+        clear_site_filter_button.pack(side='left')
+        site_chooser_frame.pack(fill='x', expand=True)
+
+        site_frame.pack(
+            side='top',
+            fill='x',
+            expand=True,
+            padx=PAD_MEDIUM,
+            pady=PAD_SMALL
+        )
+
+        # overall subject frame
+        subject_frame = Tkinter.Frame(metadata_frame, bg=BACKGROUND_COLOR)
+
+        # subject label frame
+        subject_chooser_label_frame = Tkinter.Frame(
+            subject_frame,
+            bg=BACKGROUND_COLOR
+        )
+        subject_chooser_label = Tkinter.Label(
+            subject_chooser_label_frame,
+            text='Subject:',
+            bg=BACKGROUND_COLOR,
+            width=LABEL_WIDTH,
+            anchor=Tkinter.E
+        )
+        subject_chooser_label.pack(side='left')
+        subject_chooser_label_frame.pack(side='left', fill='x')
+
+        # subject chooser listbox frame
+        subject_chooser_frame = Tkinter.Frame(
+            subject_frame,
+            bg=BACKGROUND_COLOR
+        )
+        self.subject_menu = FilterCombobox(
+            subject_chooser_frame,
+            self.subject_selection
+        )
+        self.subject_menu.pack(fill='x', expand=True, side='left')
+        clear_subject_filter_button = ttk.Button(
+            subject_chooser_frame,
+            text='Clear',
+            command=self.clear_subject_filter
+        )
+        clear_subject_filter_button.pack(side='left')
+        subject_chooser_frame.pack(fill='x', expand=True)
+
+        subject_frame.pack(
+            side='top',
+            fill='x',
+            expand=True,
+            padx=PAD_MEDIUM,
+            pady=PAD_SMALL
+        )
+
+        # overall visit frame
+        visit_frame = Tkinter.Frame(metadata_frame, bg=BACKGROUND_COLOR)
+
+        # visit label frame
+        visit_chooser_label_frame = Tkinter.Frame(
+            visit_frame,
+            bg=BACKGROUND_COLOR
+        )
+        visit_chooser_label = Tkinter.Label(
+            visit_chooser_label_frame,
+            text='Visit:',
+            bg=BACKGROUND_COLOR,
+            width=LABEL_WIDTH,
+            anchor=Tkinter.E
+        )
+        visit_chooser_label.pack(side='left')
+        visit_chooser_label_frame.pack(side='left', fill='x')
+
+        # visit chooser listbox frame
+        visit_chooser_frame = Tkinter.Frame(visit_frame, bg=BACKGROUND_COLOR)
+        self.visit_menu = FilterCombobox(
+            visit_chooser_frame,
+            self.visit_selection
+        )
+        self.visit_menu.pack(fill='x', expand=True, side='left')
+        clear_visit_filter_button = ttk.Button(
+            visit_chooser_frame,
+            text='Clear',
+            command=self.clear_visit_filter
+        )
+        clear_visit_filter_button.pack(side='left')
+        visit_chooser_frame.pack(fill='x', expand=True)
+
+        visit_frame.pack(
+            side='top',
+            fill='x',
+            expand=True,
+            padx=PAD_MEDIUM,
+            pady=PAD_SMALL
+        )
+
+        # overall panel_template frame
+        panel_template_frame = Tkinter.Frame(
+            metadata_frame,
+            bg=BACKGROUND_COLOR
+        )
+
+        # panel_template label frame
+        panel_template_chooser_label_frame = Tkinter.Frame(
+            panel_template_frame,
+            bg=BACKGROUND_COLOR
+        )
+        panel_template_chooser_label = Tkinter.Label(
+            panel_template_chooser_label_frame,
+            text='Panel Template:',
+            bg=BACKGROUND_COLOR,
+            width=LABEL_WIDTH,
+            anchor=Tkinter.E
+        )
+        panel_template_chooser_label.pack(side='left')
+        panel_template_chooser_label_frame.pack(side='left', fill='x')
+
+        # panel_template chooser listbox frame
+        panel_template_chooser_frame = Tkinter.Frame(
+            panel_template_frame,
+            bg=BACKGROUND_COLOR
+        )
+        self.panel_template_menu = FilterCombobox(
+            panel_template_chooser_frame,
+            self.panel_template_selection
+        )
+        self.panel_template_menu.pack(fill='x', expand=True, side='left')
+        clear_panel_template_filter_button = ttk.Button(
+            panel_template_chooser_frame,
+            text='Clear',
+            command=self.clear_panel_template_filter
+        )
+        clear_panel_template_filter_button.pack(side='left')
+        panel_template_chooser_frame.pack(fill='x', expand=True)
+
+        panel_template_frame.pack(
+            side='top',
+            fill='x',
+            expand=True,
+            padx=PAD_MEDIUM,
+            pady=PAD_SMALL
+        )
+
+        # overall stimulation frame
+        stimulation_frame = Tkinter.Frame(
+            metadata_frame,
+            bg=BACKGROUND_COLOR
+        )
+
+        # stimulation label frame
+        stimulation_chooser_label_frame = Tkinter.Frame(
+            stimulation_frame,
+            bg=BACKGROUND_COLOR
+        )
+        stimulation_chooser_label = Tkinter.Label(
+            stimulation_chooser_label_frame,
+            text='Stimulation:',
+            bg=BACKGROUND_COLOR,
+            width=LABEL_WIDTH,
+            anchor=Tkinter.E
+        )
+        stimulation_chooser_label.pack(side='left')
+        stimulation_chooser_label_frame.pack(side='left', fill='x')
+
+        # stimulation chooser listbox frame
+        stimulation_chooser_frame = Tkinter.Frame(
+            stimulation_frame,
+            bg=BACKGROUND_COLOR
+        )
+        self.stimulation_menu = FilterCombobox(
+            stimulation_chooser_frame,
+            self.stimulation_selection
+        )
+        self.stimulation_menu.pack(fill='x', expand=True, side='left')
+        clear_stimulation_filter_button = ttk.Button(
+            stimulation_chooser_frame,
+            text='Clear',
+            command=self.clear_stimulation_filter
+        )
+        clear_stimulation_filter_button.pack(side='left')
+        stimulation_chooser_frame.pack(fill='x', expand=True)
+
+        stimulation_frame.pack(
+            side='top',
+            fill='x',
+            expand=True,
+            padx=PAD_MEDIUM,
+            pady=PAD_SMALL
+        )
+
+        self.load_user_projects()
+
+        # start file chooser widgets
+        file_chooser_frame = Tkinter.Frame(
+            middle_right_frame,
+            bg=BACKGROUND_COLOR
+        )
+
+        # file name search
+        search_frame = Tkinter.Frame(
+            file_chooser_frame,
+            bg=BACKGROUND_COLOR
+        )
+        search_label = Tkinter.Label(
+            search_frame,
+            text='Search:',
+            bg=BACKGROUND_COLOR
+        )
+        search_label.pack(side='left')
+        search_entry = Tkinter.Entry(
+            search_frame,
+            textvariable=self.search_text,
+            highlightbackground=BACKGROUND_COLOR
+        )
+        search_entry.pack(
+            fill='x',
+            expand=True,
+            side='left',
+            padx=PAD_SMALL
+        )
+        select_matches_button = ttk.Button(
+            search_frame,
+            text='Select Matches',
+            command=self.select_matching_files
+        )
+        select_matches_button.pack(side='left')
+        search_frame.pack(fill='x')
+
+        file_list_frame = Tkinter.Frame(
+            file_chooser_frame,
+            bg=BACKGROUND_COLOR,
+            highlightcolor=HIGHLIGHT_COLOR,
+            highlightbackground=BORDER_COLOR,
+            highlightthickness=1
+        )
+        file_scroll_bar = Tkinter.Scrollbar(
+            file_list_frame,
+            orient='vertical'
+        )
+        self.file_list_canvas = Tkinter.Canvas(
+            file_list_frame,
+            yscrollcommand=file_scroll_bar.set,
+            relief='flat',
+            borderwidth=0,
+            bg=BACKGROUND_COLOR
+        )
+        self.file_list_canvas.bind('<MouseWheel>', self._on_mousewheel)
+
+        # for linux
+        self.file_list_canvas.bind(
+            '<Button-4>',
+            lambda event: self.file_list_canvas.yview_scroll(
+                -1,
+                'units'
+            )
+        )
+        self.file_list_canvas.bind(
+            '<Button-5>',
+            lambda event: self.file_list_canvas.yview_scroll(
+                1,
+                'units'
+            )
+        )
+
+        file_scroll_bar.config(command=self.file_list_canvas.yview)
+        file_scroll_bar.pack(side='right', fill='y')
+        self.file_list_canvas.pack(
+            fill='both',
+            expand=True
+        )
+        file_list_frame.pack(
+            fill='both',
+            expand=True,
+            pady=(PAD_LARGE, 0)
+        )
+        file_chooser_frame.pack(
+            fill='both',
+            expand=True,
+            anchor='n'
+        )
+
+        # Progress bar
+        progress_frame = Tkinter.Frame(bottom_frame, bg=BACKGROUND_COLOR)
+        self.download_progress_bar = ttk.Progressbar(progress_frame)
+        self.download_progress_bar.pack(side='bottom', fill='x', expand=True)
+        self.transfer_stats_label = Tkinter.Label(
+            progress_frame,
+            bg=BACKGROUND_COLOR,
+            anchor=Tkinter.W
+        )
+        self.transfer_stats_label.pack(side='bottom', fill='x')
+        progress_frame.pack(
+            fill='x',
+            expand=False,
+            anchor='s'
+        )
+
+        # filter profiles menu, to save the current filters & watch them
+        # for new samples
+        self.profile_menu = Tkinter.Menu(self.menu_bar, tearoff=0)
+        self.menu_bar.add_cascade(label='Profiles', menu=self.profile_menu)
+        self.populate_profile_menu()
+
+        # selection menu, to share the selected samples as an ID list
+        selection_menu = Tkinter.Menu(self.menu_bar, tearoff=0)
+        selection_menu.add_command(
+            label='Export Selection...',
+            command=self.export_selection
+        )
+        selection_menu.add_command(
+            label='Import Selection...',
+            command=self.import_selection
+        )
+        self.menu_bar.add_cascade(label='Selection', menu=selection_menu)
+
+        account_menu = Tkinter.Menu(self.menu_bar, tearoff=0)
+        account_menu.add_command(
+            label='Forget Saved Login',
+            command=self.forget_saved_login
+        )
+        self.menu_bar.add_cascade(label='Account', menu=account_menu)
+
+        # offer to finish a batch left over from a previous session
+        self.resume_interrupted_download()
+
+        self.poll_watched_profiles()
+
+    def _on_mousewheel(self, event):
+        self.file_list_canvas.yview_scroll(-event.delta, "units")
+
+    # noinspection PyUnusedLocal
+    def schedule_apply_filters(self, *args):
+        # restart the debounce window on every change so rapid clicks
+        # result in a single query
+        if self.apply_filters_after_id is not None:
+            self.after_cancel(self.apply_filters_after_id)
+
+        self.apply_filters_after_id = self.after(
+            FILTER_DEBOUNCE_INTERVAL,
+            self.apply_filters
+        )
+
+    def apply_filters(self):
+        if self.apply_filters_after_id is not None:
+            self.after_cancel(self.apply_filters_after_id)
+            self.apply_filters_after_id = None
+
+        # only the latest query is rendered
+        if self.sample_query is not None:
+            self.sample_query.cancel()
+            self.sample_query = None
+
+        if self.file_list_canvas is None:
+            # main frame isn't loaded yet
+            return
+
+        if self.profile_selections:
+            # a profile is being applied, keep its result set until all
+            # the menus are restored
+            return
+
+        # the filters now decide the sample list rather than an applied
+        # profile
+        self.profile_query_name = None
+
+        project_name = self.project_selection.get()
+        if project_name in self.project_dict:
+            project_id = self.project_dict[project_name]
+        else:
+            # if we don't get a project ID then there's nothing to do but
+            # clear the canvas
+            self.file_list_canvas.delete(Tkinter.ALL)
+            self.file_list_checkbuttons = []
+            self.build_sample_index()
+            return
+
+        # use the prefetched sample list if we have it, or wait for it if
+        # it's on the way
+        self.apply_filters_after_prefetch = False
+        if project_id in self.project_samples:
+            samples = self.filter_project_samples(project_id)
+            if samples is not None:
+                self.load_samples({'data': samples})
+                return
+        elif project_id == self.sample_prefetch_project_id:
+            self.apply_filters_after_prefetch = True
+            return
+
+        site_name = self.site_selection.get()
+        if site_name in self.site_dict:
+            site_id = self.site_dict[site_name]
+        else:
+            site_id = None
+
+        subject_name = self.subject_selection.get()
+        if subject_name in self.subject_dict:
+            subject_id = self.subject_dict[subject_name]
+        else:
+            subject_id = None
+
+        visit_name = self.visit_selection.get()
+        if visit_name in self.visit_dict:
+            visit_id = self.visit_dict[visit_name]
+        else:
+            visit_id = None
+
+        panel_template_name = self.panel_template_selection.get()
+        if panel_template_name in self.panel_template_dict:
+            panel_template_id = self.panel_template_dict[panel_template_name]
+        else:
+            panel_template_id = None
+
+        stimulation_name = self.stimulation_selection.get()
+        if stimulation_name in self.stimulation_dict:
+            stimulation_id = self.stimulation_dict[stimulation_name]
+        else:
+            stimulation_id = None
+
+        self.sample_query = self.transfer_pool.submit(
+            rest.get_samples,
+            (self.host, self.token),
+            {
+                'project_pk': project_id,
+                'site_pk': site_id,
+                'subject_pk': subject_id,
+                'visit_pk': visit_id,
+                'project_panel_pk': panel_template_id,
+                'stimulation_pk': stimulation_id
+            },
+            callback=self.load_samples
+        )
+
+    def refresh_filters(self):
+        # the cached sample list is shown straight away & fetched again,
+        # new uploads appear once the fresh list arrives
+        project_id = self.get_selected_project_id()
+        if project_id is not None:
+            if project_id != self.sample_prefetch_project_id:
+                self.prefetch_project_samples(project_id)
+
+        self.apply_filters()
+
+    def prefetch_project_samples(self, project_id):
+        if self.sample_prefetch is not None:
+            self.sample_prefetch.cancel()
+
+        self.sample_prefetch_project_id = project_id
+        self.sample_prefetch = self.transfer_pool.submit(
+            rest.get_samples,
+            (self.host, self.token),
+            {'project_pk': project_id},
+            callback=lambda response: self.cache_project_samples(
+                project_id,
+                response
+            ),
+            errback=lambda error: self.cache_project_samples(project_id, {})
+        )
+
+    def cache_project_samples(self, project_id, response):
+        self.sample_prefetch = None
+        self.sample_prefetch_project_id = None
+
+        if 'data' in response:
+            self.project_samples[project_id] = response['data']
+
+        # filters applied while the list was on the way are applied now,
+        # falling back to the server if the prefetch failed. A fresh list
+        # for the project on show replaces the cached one it was drawn from
+        # (unless a profile's result set is shown).
+        if self.apply_filters_after_prefetch:
+            self.apply_filters()
+        elif 'data' in response and self.profile_query_name is None:
+            if project_id == self.get_selected_project_id():
+                self.apply_filters()
+
+    def filter_project_samples(self, project_id):
+        """
+        Returns the project's cached samples matching the current filter
+        menus, or None if the samples lack a field needed for filtering.
+        """
+        criteria = []
+        for selection_name, field in SAMPLE_FILTER_FIELDS:
+            value = getattr(self, selection_name).get()
+            if value:
+                criteria.append((field, value))
+
+        samples = []
+        for sample in self.project_samples[project_id]:
+            try:
+                if all(sample[field] == value for field, value in criteria):
+                    samples.append(sample)
+            except KeyError:
+                return None
+
+        return samples
+
+    def load_samples(self, samples):
+        self.sample_query = None
+
+        if 'data' not in samples:
+            return
+        else:
+            samples = samples['data']
+
+        # sort samples list by original filename
+        samples = sorted(samples, key=lambda k: k['original_filename'])
+
+        # the same result set (e.g. a cached profile list confirmed by the
+        # server) is left as it is, along with the user's checks
+        shown_samples = [
+            (cb.sample_metadata['id'], cb.sample_metadata['original_filename'])
+            for cb in self.file_list_checkbuttons
+        ]
+        new_samples = [(s['id'], s['original_filename']) for s in samples]
+        if shown_samples and shown_samples == new_samples:
+            return
+
+        # samples still listed stay checked
+        checked_ids = set(
+            [
+                cb.sample_metadata['id']
+                for cb in self.file_list_checkbuttons
+                if cb.is_checked()
+            ]
+        )
+
+        # clear the canvas
+        self.file_list_canvas.delete(Tkinter.ALL)
+
+        # but delete seems to just remove the objects displayed, our
+        # check box instances remain, so we need to destroy them
+        for key, cb in self.file_list_canvas.children.items():
+            cb.destroy()
+
+        self.file_list_checkbuttons = []
+
+        for i, s in enumerate(samples):
+            cb = MyCheckbutton(
+                s,
+                self.file_list_canvas,
+                text=os.path.basename(s['original_filename'])
+            )
+
+            # bind to our canvas mouse function
+            # to keep scrolling working when the mouse is over a checkbox
+            cb.bind('<MouseWheel>', self._on_mousewheel)
+
+            # for linux
+            cb.bind(
+                '<Button-4>',
+                lambda event: self.file_list_canvas.yview_scroll(
+                    -1,
+                    'units'
+                )
+            )
+            cb.bind(
+                '<Button-5>',
+                lambda event: self.file_list_canvas.yview_scroll(
+                    1,
+                    'units'
+                )
+            )
+
+            # right click (or control click) previews the FCS header
+            cb.bind('<Button-3>', self.show_sample_menu)
+            cb.bind('<Control-Button-1>', self.show_sample_menu)
+
+            cb.canvas_item = self.file_list_canvas.create_window(
+                PAD_MEDIUM,
+                PAD_LARGE + (FILE_ROW_HEIGHT * i),
+                anchor='nw',
+                window=cb
+            )
+            cb.sample_row = i
+            cb.row = i
+            if s['id'] in checked_ids:
+                cb.mark_checked()
+            self.file_list_checkbuttons.append(cb)
+
+        # update scroll region
+        self.file_list_canvas.config(
+            scrollregion=(0, 0, 1000, 10 + len(samples) * FILE_ROW_HEIGHT)
+        )
+        self.build_sample_index()
+
+        # keep the current search applied to the new list
+        if self.search_text.get().strip():
+            self.apply_search()
+
+    def build_sample_index(self):
+        # building the index takes too long for the Tk thread on large
+        # lists, until it's ready searches fall back to matching prefixes
+        if self.sample_index_task is not None:
+            self.sample_index_task.cancel()
+
+        # the names shown, without asking Tk for each one
+        self.sample_names = [
+            os.path.basename(cb.sample_metadata['original_filename']).lower()
+            for cb in self.file_list_checkbuttons
+        ]
+        self.sample_index = None
+        self.sample_index_task = self.transfer_pool.submit(
+            SampleIndex,
+            (self.sample_names,),
+            callback=self.set_sample_index
         )
 
-        download_version_label_frame = Tkinter.Frame(
-            download_options_frame,
-            bg=BACKGROUND_COLOR
+    def set_sample_index(self, sample_index):
+        self.sample_index_task = None
+        self.sample_index = sample_index
+
+        # a prefix search may be showing, replace it with the full one
+        if self.search_text.get().strip():
+            self.apply_search()
+
+    def show_sample_menu(self, event):
+        sample_menu = Tkinter.Menu(self, tearoff=0)
+        sample_menu.add_command(
+            label='Preview FCS Header',
+            command=lambda: self.preview_sample(event.widget.sample_metadata)
         )
-        download_version_label = Tkinter.Label(
-            download_version_label_frame,
-            text='Choose file types to download:',
-            bg=BACKGROUND_COLOR,
-            width=32,
-            anchor=Tkinter.W
+        sample_menu.tk_popup(event.x_root, event.y_root)
+
+        # don't toggle the check box on a control click
+        return 'break'
+
+    def get_preview_cache_path(self, sample_id):
+        return "/".join([preview_cache_dir, self.host, '%s.json' % sample_id])
+
+    def preview_sample(self, sample_metadata):
+        cache_path = self.get_preview_cache_path(sample_metadata['id'])
+
+        # noinspection PyBroadException
+        try:
+            fcs_header = json.load(open(cache_path, 'r'))
+        except Exception:
+            fcs_header = None
+
+        if fcs_header is not None:
+            self.show_sample_preview(sample_metadata, fcs_header)
+            return
+
+        self.transfer_pool.submit(
+            fetch_fcs_header,
+            (self.host, self.token, sample_metadata['id']),
+            callback=lambda result: self.cache_sample_preview(
+                sample_metadata,
+                result
+            ),
+            errback=lambda error: tkMessageBox.showwarning(
+                'Preview Failed',
+                'Could not read the FCS header of %s\n%s' % (
+                    sample_metadata['original_filename'],
+                    error
+                )
+            )
         )
-        download_version_label.pack(side='left')
-        download_version_label_frame.pack(
-            padx=PAD_LARGE,
-            pady=(PAD_LARGE, 0),
-            fill='x'
+
+    def cache_sample_preview(self, sample_metadata, fcs_header):
+        cache_path = self.get_preview_cache_path(sample_metadata['id'])
+
+        # noinspection PyBroadException
+        try:
+            if not os.path.exists(os.path.dirname(cache_path)):
+                os.makedirs(os.path.dirname(cache_path))
+            json.dump(fcs_header, open(cache_path, 'w'))
+        except Exception:
+            # well, we tried, but we can still show the preview
+            pass
+
+        self.show_sample_preview(sample_metadata, fcs_header)
+
+    def show_sample_preview(self, sample_metadata, fcs_header):
+        keywords = fcs_header['keywords']
+
+        lines = [
+            'Version: %s' % fcs_header['version'],
+            'Cytometer: %s' % keywords.get('$CYT', ''),
+            'Events: %s' % keywords.get('$TOT', ''),
+            'Parameters: %s' % keywords.get('$PAR', ''),
+            ''
+        ]
+
+        try:
+            parameter_count = int(keywords.get('$PAR', 0))
+        except ValueError:
+            parameter_count = 0
+        for i in range(1, parameter_count + 1):
+            lines.append(
+                'P%d: %s %s' % (
+                    i,
+                    keywords.get('$P%dN' % i, ''),
+                    keywords.get('$P%dS' % i, '')
+                )
+            )
+
+        lines.append('')
+        for keyword in sorted(keywords.keys()):
+            lines.append('%s: %s' % (keyword, keywords[keyword]))
+
+        preview_window = Tkinter.Toplevel(self.master)
+        preview_window.title(
+            os.path.basename(sample_metadata['original_filename'])
         )
-        download_version_options_frame = Tkinter.Frame(
-            download_options_frame,
-            bg=BACKGROUND_COLOR
+        preview_window.config(bg=BACKGROUND_COLOR)
+
+        preview_scroll_bar = Tkinter.Scrollbar(
+            preview_window,
+            orient='vertical'
         )
-        for text, value in download_version_options:
-            dl_radio_button = Tkinter.Radiobutton(
-                download_version_options_frame,
-                text=text,
-                variable=self.download_version,
-                value=value,
-                bg=BACKGROUND_COLOR,
-                highlightthickness=0
+        preview_text = Tkinter.Text(
+            preview_window,
+            yscrollcommand=preview_scroll_bar.set,
+            highlightthickness=0,
+            width=80,
+            height=30
+        )
+        preview_scroll_bar.config(command=preview_text.yview)
+        preview_scroll_bar.pack(side='right', fill='y')
+        preview_text.insert(Tkinter.END, '\n'.join(lines))
+        preview_text.config(state='disabled')
+        preview_text.pack(fill='both', expand=True)
+
+    # noinspection PyUnusedLocal
+    def schedule_search(self, *args):
+        # coalesce keystrokes typed before the UI gets idle into one search
+        if self.search_after_id is not None:
+            self.after_cancel(self.search_after_id)
+        self.search_after_id = self.after_idle(self.apply_search)
+
+    def apply_search(self):
+        self.search_after_id = None
+
+        text = self.search_text.get().strip()
+        if text and self.sample_index is None:
+            # the index is still being built
+            text = text.lower()
+            rows = [
+                row for row, name in enumerate(self.sample_names)
+                if name.startswith(text)
+            ]
+        elif text:
+            rows = self.sample_index.search(text)
+        else:
+            rows = range(len(self.file_list_checkbuttons))
+
+        # only touch the rows that are hidden, shown or moved
+        matched_rows = set(rows)
+        for cb in self.file_list_checkbuttons:
+            if cb.row is not None and cb.sample_row not in matched_rows:
+                self.file_list_canvas.itemconfigure(
+                    cb.canvas_item,
+                    state='hidden'
+                )
+                cb.row = None
+
+        for i, sample_row in enumerate(rows):
+            cb = self.file_list_checkbuttons[sample_row]
+            if cb.row == i:
+                continue
+            if cb.row is None:
+                self.file_list_canvas.itemconfigure(
+                    cb.canvas_item,
+                    state='normal'
+                )
+            self.file_list_canvas.coords(
+                cb.canvas_item,
+                PAD_MEDIUM,
+                PAD_LARGE + (FILE_ROW_HEIGHT * i)
             )
-            dl_radio_button.pack(anchor=Tkinter.W)
-        download_version_options_frame.pack(
-            padx=PAD_LARGE,
-            pady=(PAD_LARGE, 0),
-            fill='x'
+            cb.row = i
+
+        self.file_list_canvas.config(
+            scrollregion=(0, 0, 1000, 10 + len(rows) * FILE_ROW_HEIGHT)
         )
+        self.file_list_canvas.yview_moveto(0)
 
-        # overall project frame
-        project_frame = Tkinter.Frame(
-            metadata_frame,
-            bg=BACKGROUND_COLOR
+    def select_matching_files(self):
+        for cb in self.file_list_checkbuttons:
+            if cb.row is not None:
+                cb.mark_checked()
+
+    def clear_project_filter(self):
+        # clearing project filter clears all other filters
+        self.project_selection.set('')
+        self.site_selection.set('')
+        self.subject_selection.set('')
+        self.visit_selection.set('')
+        self.panel_template_selection.set('')
+        self.stimulation_selection.set('')
+
+        # filters are re-applied by the selection traces
+
+    def clear_site_filter(self):
+        # filters are re-applied by the selection trace
+        self.site_selection.set('')
+
+    def clear_subject_filter(self):
+        # filters are re-applied by the selection trace
+        self.subject_selection.set('')
+
+    def clear_visit_filter(self):
+        # filters are re-applied by the selection trace
+        self.visit_selection.set('')
+
+    def clear_panel_template_filter(self):
+        # filters are re-applied by the selection trace
+        self.panel_template_selection.set('')
+
+    def clear_stimulation_filter(self):
+        # filters are re-applied by the selection trace
+        self.stimulation_selection.set('')
+
+    def select_all_files(self):
+        for k, v in self.file_list_canvas.children.items():
+            if isinstance(v, MyCheckbutton):
+                v.mark_checked()
+
+    def clear_all_files(self):
+        for k, v in self.file_list_canvas.children.items():
+            if isinstance(v, MyCheckbutton):
+                v.mark_unchecked()
+
+    def choose_download_parent_dir(self):
+        chosen_dir = tkFileDialog.askdirectory(
+            initialdir=self.download_parent_dir.get()
         )
+        if not os.access(chosen_dir, os.EX_OK):
+            return
+        self.download_parent_dir.set(chosen_dir)
+
+    @staticmethod
+    def get_sample_directory(
+            parent_dir,
+            sample_metadata,
+            download_structure
+    ):
+        # without a parent directory the path is relative, as used for
+        # member paths inside an archive
+        if parent_dir is None:
+            dir_list = []
+        else:
+            dir_list = [parent_dir]
+
+        if download_structure == 'flat':
+            pass
+        elif download_structure == 'nested_psv':
+            dir_list.extend(
+                [
+                    sample_metadata['project_name'],
+                    sample_metadata['site_name'],
+                    sample_metadata['visit_name']
+                ]
+            )
+        elif download_structure == 'nested_pvs':
+            dir_list.extend(
+                [
+                    sample_metadata['project_name'],
+                    sample_metadata['visit_name'],
+                    sample_metadata['site_name']
+                ]
+            )
+
+        return "/".join(dir_list)
+
+    @staticmethod
+    def create_sample_directory(dir_path):
+        if not os.path.exists(dir_path):
+            os.makedirs(dir_path)
+
+        return dir_path
+
+    def _check_existing_sample(self, batch, job):
+        # check if sample exists in path & if it's hash matches
+        # first, any entry counts to avoid clobbering any file/dir/link
+        # that may exist, we don't want to mess with anything
+        # on the user's system
+        if batch.get_local_file(job) is None:
+            return None
+
+        # check SHA checksum for original file (can't do this for
+        # clean file as the server doesn't have the SHA checksum...the
+        # clean files are generated on the fly), instead a clean file
+        # written by the client is checked against the fingerprint
+        # recorded at the time
+        if job.clean:
+            fingerprint = self._get_clean_fingerprint(batch, job)
+            if fingerprint is None:
+                return self._resolve_conflict(
+                    batch,
+                    job,
+                    'Clean file already exists with no recorded checksum'
+                )
+
+            # an untouched file is recognised by its size & time, anything
+            # else is hashed
+            is_file, size, modified_time = batch.get_local_file(job)
+            if size != fingerprint['size']:
+                return self._resolve_conflict(
+                    batch,
+                    job,
+                    'Clean file has changed since it was downloaded'
+                )
+            elif modified_time == fingerprint['modified_time']:
+                return 'exists'
+
+        # hash the existing file in the background, the result is handled
+        # in _finish_existing_sample
+        batch.verifier.submit(job)
+        return 'verifying'
+
+    def _finish_existing_sample(self, batch, job, sha1_digest):
+        if job.clean:
+            expected_sha1 = self._get_clean_fingerprint(batch, job)['sha1']
+        else:
+            expected_sha1 = job.sample_metadata['sha1']
+
+        if sha1_digest == expected_sha1:
+            # don't re-download if identical
+            return 'exists'
 
-        # project label frame
-        project_chooser_label_frame = Tkinter.Frame(
-            project_frame,
-            bg=BACKGROUND_COLOR)
-        project_chooser_label = Tkinter.Label(
-            project_chooser_label_frame,
-            text='Project:',
-            bg=BACKGROUND_COLOR,
-            width=LABEL_WIDTH,
-            anchor=Tkinter.E
+        return self._resolve_conflict(
+            batch,
+            job,
+            'File does not match the file on the ReFlow server'
         )
-        project_chooser_label.pack(side='left')
-        project_chooser_label_frame.pack(side='left', fill='x')
 
-        # project chooser listbox frame
-        project_chooser_frame = Tkinter.Frame(
-            project_frame,
-            bg=BACKGROUND_COLOR)
-        self.project_menu = Tkinter.OptionMenu(
-            project_chooser_frame,
-            self.project_selection,
-            ''
-        )
-        self.project_menu.config(
-            bg=BACKGROUND_COLOR,
-            width=28
+    @staticmethod
+    def _get_clean_fingerprint(batch, job):
+        # only valid while the sample's original is unchanged on the server
+        fingerprint = batch.clean_fingerprints.get(os.path.abspath(job.path))
+        if fingerprint is None:
+            return None
+        if fingerprint['sample_id'] != job.sample_metadata['id']:
+            return None
+        if fingerprint['original_sha1'] != job.sample_metadata['sha1']:
+            return None
+        if not batch.get_local_file(job)[0]:
+            return None
+
+        return fingerprint
+
+    def _resolve_conflict(self, batch, job, reason):
+        # conflicts don't stop the batch, the policy chosen for the batch
+        # is applied & reported when the batch ends. Returns None if the
+        # file should be downloaded.
+        if job.conflict_reason is not None:
+            # a numbered copy didn't match, try the next one
+            return self._rename_sample(batch, job)
+
+        policy = batch.conflict_policy
+        is_file, size, modified_time = batch.get_local_file(job)
+        if policy == 'overwrite' and not is_file:
+            # never replace a directory or link
+            policy = 'skip'
+
+        if policy == 'overwrite':
+            batch.warnings.append('%s, replaced: %s' % (reason, job.path))
+            return None
+        elif policy == 'rename':
+            return self._start_rename(batch, job, reason)
+
+        batch.warnings.append('%s, skipped: %s' % (reason, job.path))
+        return 'conflict'
+
+    def _resolve_duplicate(self, batch, job):
+        # another job of the batch is saved to the same path, only one of
+        # them can be written there so the rest are renamed or skipped
+        # (never overwritten, they would be written at the same time)
+        reason = 'Another file in this download has the same name'
+        if batch.conflict_policy == 'rename':
+            return self._start_rename(batch, job, reason)
+
+        batch.warnings.append('%s, skipped: %s' % (reason, job.path))
+        return 'conflict'
+
+    def _start_rename(self, batch, job, reason):
+        # a copy saved by an earlier batch may already match, those are
+        # checked before the file is saved under a new name
+        job.conflict_reason = reason
+        job.conflict_path = job.path
+        job.copy_candidates = get_numbered_copies(
+            job.file_name,
+            batch.local_files[job.sample_dir]
         )
-        self.project_menu.pack(fill='x', expand=True, side='left')
-        clear_project_filter_button = ttk.Button(
-            project_chooser_frame,
-            text='Clear',
-            command=self.clear_project_filter
+        return self._rename_sample(batch, job)
+
+    def _rename_sample(self, batch, job):
+        # checks the job's next numbered copy, like _check_existing_sample
+        # the copy is either matched here or hashed in the background
+        while job.copy_candidates:
+            job.file_name = job.copy_candidates.pop(0)
+            if job.path in batch.claimed_paths:
+                # left to the job of the batch that is saved there
+                continue
+            if not job.clean:
+                batch.verifier.submit(job)
+                return 'verifying'
+
+            fingerprint = self._get_clean_fingerprint(batch, job)
+            if fingerprint is None:
+                continue
+
+            is_file, size, modified_time = batch.get_local_file(job)
+            if size != fingerprint['size']:
+                continue
+            elif modified_time == fingerprint['modified_time']:
+                return 'exists'
+
+            batch.verifier.submit(job)
+            return 'verifying'
+
+        entries = batch.local_files[job.sample_dir]
+        job.file_name = get_unused_file_name(
+            os.path.basename(job.conflict_path),
+            entries
         )
-        clear_project_filter_button.pack(side='left')
-        project_chooser_frame.pack(fill='x', expand=True)
 
-        project_frame.pack(
-            side='top',
-            fill='x',
-            expand=True,
-            padx=PAD_MEDIUM,
-            pady=PAD_SMALL
+        # reserve the new name for the rest of the batch, nothing is
+        # written to it yet
+        entries[job.file_name] = (True, None, None)
+        batch.claimed_paths.add(job.path)
+        batch.warnings.append(
+            '%s, saved as %s: %s' % (
+                job.conflict_reason,
+                job.file_name,
+                job.conflict_path
+            )
         )
+        return None
 
-        # overall site frame
-        site_frame = Tkinter.Frame(metadata_frame, bg=BACKGROUND_COLOR)
+    def _download_sample(self, job, archive=None):
+        # stream the sample from the ReFlow REST API, compressed if the
+        # server supports it
+        def write_sample(sample_file):
+            stream_sample(
+                self.host,
+                self.token,
+                job.sample_metadata['id'],
+                sample_file,
+                clean=job.clean,
+                stats=self.transfer_stats,
+                cancel_event=job.cancel_event
+            )
 
-        # site label frame
-        site_chooser_label_frame = Tkinter.Frame(
-            site_frame,
-            bg=BACKGROUND_COLOR
-        )
-        site_chooser_label = Tkinter.Label(
-            site_chooser_label_frame,
-            text='Site:',
-            bg=BACKGROUND_COLOR,
-            width=LABEL_WIDTH,
-            anchor=Tkinter.E
-        )
-        site_chooser_label.pack(side='left')
-        site_chooser_label_frame.pack(side='left', fill='x')
+        if archive is not None:
+            archive.write_sample(job, write_sample)
+            return
 
-        # site chooser listbox frame
-        site_chooser_frame = Tkinter.Frame(
-            site_frame,
-            bg=BACKGROUND_COLOR
-        )
-        self.site_menu = Tkinter.OptionMenu(
-            site_chooser_frame,
-            self.site_selection,
-            ''
-        )
-        self.site_menu.config(bg=BACKGROUND_COLOR)
-        self.site_menu.pack(fill='x', expand=True, side='left')
-        clear_site_filter_button = ttk.Button(
-            site_chooser_frame,
-            text='Clear',
-            command=self.clear_site_filter
-        )
-        clear_site_filter_button.pack(side='left')
-        site_chooser_frame.pack(fill='x', expand=True)
+        if not job.clean:
+            # checked against the server's checksum before the file gets
+            # its final name
+            digest = hashlib.sha1()
+            with AtomicFileWriter(job.path, digest=digest) as sample_file:
+                write_sample(sample_file)
+                if digest.hexdigest() != job.sample_metadata['sha1']:
+                    raise DownloadIncomplete(
+                        'file does not match the file on the ReFlow server'
+                    )
+            return
 
-        site_frame.pack(
-            side='top',
-            fill='x',
-            expand=True,
-            padx=PAD_MEDIUM,
-            pady=PAD_SMALL
-        )
+        # the server has no checksum for clean files, so one is computed
+        # as the file is written & recorded to recognise it later
+        digest = hashlib.sha1()
+        with AtomicFileWriter(job.path, digest=digest) as sample_file:
+            write_sample(sample_file)
+
+        file_stat = os.stat(job.path)
+        job.fingerprint = {
+            'sample_id': job.sample_metadata['id'],
+            'original_sha1': job.sample_metadata['sha1'],
+            'size': file_stat.st_size,
+            'modified_time': file_stat.st_mtime,
+            'sha1': digest.hexdigest()
+        }
+
+    def get_selected_samples(self):
+        selected_samples = []
+        for k, v in self.file_list_canvas.children.items():
+            if isinstance(v, MyCheckbutton):
+                if v.is_checked():
+                    selected_samples.append(v.sample_metadata)
 
-        # overall subject frame
-        subject_frame = Tkinter.Frame(metadata_frame, bg=BACKGROUND_COLOR)
+        return selected_samples
 
-        # subject label frame
-        subject_chooser_label_frame = Tkinter.Frame(
-            subject_frame,
-            bg=BACKGROUND_COLOR
-        )
-        subject_chooser_label = Tkinter.Label(
-            subject_chooser_label_frame,
-            text='Subject:',
-            bg=BACKGROUND_COLOR,
-            width=LABEL_WIDTH,
-            anchor=Tkinter.E
+    def queue_selected(self):
+        for sample_metadata in self.get_selected_samples():
+            self.queued_samples[sample_metadata['id']] = sample_metadata
+
+        # the selection is now held by the queue
+        self.clear_all_files()
+        self.update_queued_samples_label()
+
+    def export_selection(self):
+        # queued samples are part of the selection
+        sample_ids = self.queued_samples.keys() + [
+            sample_metadata['id']
+            for sample_metadata in self.get_selected_samples()
+        ]
+        if not sample_ids:
+            tkMessageBox.showwarning(
+                'Nothing Selected',
+                'Please select or queue samples to export.'
+            )
+            return
+
+        selection_path = tkFileDialog.asksaveasfilename(
+            initialdir=self.download_parent_dir.get(),
+            initialfile='reflow_selection.txt',
+            defaultextension='.txt'
         )
-        subject_chooser_label.pack(side='left')
-        subject_chooser_label_frame.pack(side='left', fill='x')
+        if not selection_path:
+            return
 
-        # subject chooser listbox frame
-        subject_chooser_frame = Tkinter.Frame(
-            subject_frame,
-            bg=BACKGROUND_COLOR
+        try:
+            selection_fh = open(selection_path, 'w')
+            selection_fh.write(format_id_list(sample_ids) + '\n')
+            selection_fh.close()
+        except IOError, e:
+            tkMessageBox.showwarning(
+                'Error Exporting Selection',
+                'Could not write %s:\n%s' % (selection_path, e)
+            )
+
+    def import_selection(self):
+        selection_path = tkFileDialog.askopenfilename(
+            initialdir=self.download_parent_dir.get()
         )
-        self.subject_menu = Tkinter.OptionMenu(
-            subject_chooser_frame,
-            self.subject_selection,
-            ''
+        if not selection_path:
+            return
+
+        try:
+            sample_ids = parse_id_list(open(selection_path, 'r').read())
+        except (IOError, ValueError), e:
+            tkMessageBox.showwarning(
+                'Error Importing Selection',
+                'Could not read a sample ID list from %s:\n%s' % (
+                    selection_path,
+                    e
+                )
+            )
+            return
+
+        # samples in the file list are checked, those in other prefetched
+        # projects (or hidden by the filters) are queued
+        found_ids = set()
+        for cb in self.file_list_checkbuttons:
+            if cb.sample_metadata['id'] in sample_ids:
+                cb.mark_checked()
+                found_ids.add(cb.sample_metadata['id'])
+
+        for samples in self.project_samples.values():
+            for sample_metadata in samples:
+                sample_id = sample_metadata['id']
+                if sample_id in sample_ids and sample_id not in found_ids:
+                    self.queued_samples[sample_id] = sample_metadata
+                    found_ids.add(sample_id)
+
+        self.update_queued_samples_label()
+
+        missing_count = len(sample_ids) - len(found_ids)
+        if missing_count:
+            tkMessageBox.showwarning(
+                'Samples Not Found',
+                '%d of %d sample(s) in the list were not found in the '
+                'loaded projects. Choose their project and import the '
+                'list again to select them.' % (
+                    missing_count,
+                    len(sample_ids)
+                )
+            )
+
+    def update_queued_samples_label(self):
+        if self.queued_samples:
+            text = '%d sample(s) queued' % len(self.queued_samples)
+        else:
+            text = ''
+        self.queued_samples_label.config(text=text)
+
+    def get_download_jobs(
+            self,
+            samples,
+            parent_dir,
+            download_structure,
+            download_version,
+            download_output
+    ):
+        jobs = []
+        for sample_metadata in samples:
+            if download_output == 'folder':
+                sample_dir = self.get_sample_directory(
+                    parent_dir,
+                    sample_metadata,
+                    download_structure
+                )
+            else:
+                # member path inside the archive
+                sample_dir = self.get_sample_directory(
+                    None,
+                    sample_metadata,
+                    download_structure
+                )
+
+            if download_version in ['both', 'original']:
+                # download original file
+                jobs.append(DownloadJob(sample_metadata, sample_dir))
+            if download_version in ['both', 'clean']:
+                # download clean file
+                jobs.append(
+                    DownloadJob(sample_metadata, sample_dir, clean=True)
+                )
+
+        return jobs
+
+    def download_selected(self, dry_run=False):
+        parent_dir = self.download_parent_dir.get()
+        download_structure = self.download_structure.get()
+        download_version = self.download_version.get()
+        download_output = self.download_output.get()
+
+        # make sure we have write permissions for parent directory
+        if not os.access(parent_dir, os.W_OK):
+            tkMessageBox.showwarning(
+                'Insufficient Permissions',
+                'You do not have permission to write to %s' % parent_dir
+            )
+            return
+
+        # queued samples from other projects or filters are downloaded in
+        # the same batch as the current selection
+        samples = collections.OrderedDict(self.queued_samples)
+        for sample_metadata in self.get_selected_samples():
+            samples[sample_metadata['id']] = sample_metadata
+
+        jobs = self.get_download_jobs(
+            samples.values(),
+            parent_dir,
+            download_structure,
+            download_version,
+            download_output
         )
-        self.subject_menu.config(bg=BACKGROUND_COLOR)
-        self.subject_menu.pack(fill='x', expand=True, side='left')
-        clear_subject_filter_button = ttk.Button(
-            subject_chooser_frame,
-            text='Clear',
-            command=self.clear_subject_filter
+        if not jobs:
+            tkMessageBox.showwarning(
+                'Nothing Selected',
+                'Please select or queue samples to download.'
+            )
+            return
+
+        batch_name = get_batch_name()
+        metadata_path = "/".join([parent_dir, batch_name + '_metadata'])
+
+        def start_download():
+            if self.download_batch is None:
+                self.queued_samples.clear()
+                self.update_queued_samples_label()
+
+            if download_output == 'folder':
+                self.download_jobs(jobs, metadata_path=metadata_path)
+                return
+
+            archive_path = "/".join(
+                [
+                    parent_dir,
+                    '%s.%s' % (batch_name, download_output)
+                ]
+            )
+            self.download_jobs(
+                jobs,
+                archive_path=archive_path,
+                archive_format=download_output,
+                metadata_path=metadata_path
+            )
+
+        # existing files are verified rather than downloaded again (the
+        # target directories are listed in the background), every file is
+        # transferred into a new archive. A sample of the files is sized
+        # before starting.
+        self.transfer_stats_label.config(text='Estimating download size...')
+        self.transfer_pool.submit(
+            plan_download,
+            (self.host, self.token, jobs, download_output == 'folder'),
+            callback=lambda transfer_plan: self.check_download_plan(
+                parent_dir,
+                jobs,
+                transfer_plan,
+                dry_run,
+                start_download
+            ),
+            errback=lambda error: self.check_download_plan(
+                parent_dir,
+                jobs,
+                (jobs, None),
+                dry_run,
+                start_download
+            )
         )
-        clear_subject_filter_button.pack(side='left')
-        subject_chooser_frame.pack(fill='x', expand=True)
 
-        subject_frame.pack(
-            side='top',
-            fill='x',
-            expand=True,
-            padx=PAD_MEDIUM,
-            pady=PAD_SMALL
+    def check_download_plan(
+            self,
+            parent_dir,
+            jobs,
+            transfer_plan,
+            dry_run,
+            start_download
+    ):
+        self.transfer_stats_label.config(text=self.transfer_stats.summary())
+        transfer_jobs, expected_bytes = transfer_plan
+
+        try:
+            free_bytes = get_free_space(parent_dir)
+        except (OSError, AttributeError):
+            free_bytes = None
+
+        plan = [
+            'Files selected: %d' % len(jobs),
+            'Files already present: %d' % (len(jobs) - len(transfer_jobs)),
+            'Files to download: %d' % len(transfer_jobs)
+        ]
+
+        if expected_bytes is None:
+            plan.append('Estimated size: unknown')
+        else:
+            plan.append(
+                'Estimated size: %s' % format_byte_count(expected_bytes)
+            )
+        if free_bytes is not None:
+            plan.append('Free space: %s' % format_byte_count(free_bytes))
+        if expected_bytes is not None and self.throughput:
+            plan.append(
+                'Estimated time: %s' % format_duration(
+                    expected_bytes / self.throughput
+                )
+            )
+
+        if dry_run:
+            tkMessageBox.showinfo('Download Plan', '\n'.join(plan))
+            return
+
+        if expected_bytes is not None and free_bytes is not None:
+            if expected_bytes > free_bytes:
+                tkMessageBox.showwarning(
+                    'Insufficient Disk Space',
+                    'There is not enough free space in %s for this '
+                    'download.\n\n%s' % (parent_dir, '\n'.join(plan))
+                )
+                return
+            elif expected_bytes > free_bytes * PREFLIGHT_FREE_SPACE_RATIO:
+                proceed = tkMessageBox.askyesno(
+                    'Low Disk Space',
+                    'This download will nearly fill %s. Continue?'
+                    '\n\n%s' % (parent_dir, '\n'.join(plan))
+                )
+                if not proceed:
+                    return
+
+        start_download()
+
+    def download_jobs(
+            self,
+            jobs,
+            archive_path=None,
+            archive_format=None,
+            metadata_path=None,
+            finish_callback=None,
+            conflict_policy=None,
+            show_report=True
+    ):
+        if self.download_batch is not None:
+            tkMessageBox.showwarning(
+                'Download In Progress',
+                'Please wait for the current download to finish.'
+            )
+            return
+
+        archive = None
+        if archive_path is not None:
+            try:
+                archive = ArchiveWriter(archive_path, archive_format)
+            except (IOError, OSError):
+                tkMessageBox.showwarning(
+                    'Error creating archive',
+                    'Could not create archive %s' % archive_path
+                )
+                return
+
+        # record the batch before transferring anything so an interrupted
+        # download can be resumed on the next launch, archives are written
+        # in a single pass and can't be resumed
+        if archive is None:
+            journal = DownloadJournal(download_journal_path)
+        else:
+            journal = DownloadJournal(None)
+        journal.start(self.host, jobs)
+
+        self.download_progress_bar.config(maximum=len(jobs), value=0)
+        self.progress_drawn_count = 0
+
+        # pre-flight: existing original files are verified on a pool of
+        # hashing threads while the missing files are downloaded
+        verifier = HashVerifier()
+        batch = DownloadBatch(
+            jobs,
+            journal,
+            verifier,
+            archive=archive,
+            metadata_path=metadata_path,
+            finish_callback=finish_callback,
+            conflict_policy=conflict_policy or self.conflict_policy.get(),
+            show_report=show_report
         )
+        self.download_batch = batch
 
-        # overall visit frame
-        visit_frame = Tkinter.Frame(metadata_frame, bg=BACKGROUND_COLOR)
+        # the queue order chosen in an earlier batch carries over
+        batch.smallest_first = bool(self.queue_smallest_first.get())
+        batch.start_bytes_written = self.transfer_stats.bytes_written
 
-        # visit label frame
-        visit_chooser_label_frame = Tkinter.Frame(
-            visit_frame,
-            bg=BACKGROUND_COLOR
+        if archive is None:
+            batch.clean_fingerprints = load_json_file(
+                clean_fingerprints_path
+            ).get(self.host, {})
+
+        if archive is not None or not batch.sample_dirs:
+            # every sample goes into the new archive
+            self._start_batch(batch)
+            return
+
+        # each target directory is listed once, in parallel on the pool,
+        # so deciding whether a file exists is a dictionary lookup rather
+        # than a stat call per file (slow on network shares)
+        for sample_dir in batch.sample_dirs:
+            self.transfer_pool.submit(
+                scan_directory,
+                (sample_dir,),
+                callback=lambda entries, d=sample_dir: self._finish_scan(
+                    batch,
+                    d,
+                    entries
+                ),
+                errback=lambda error, d=sample_dir: self._finish_scan(
+                    batch,
+                    d,
+                    error
+                )
+            )
+
+    def _finish_scan(self, batch, sample_dir, entries):
+        batch.local_files[sample_dir] = entries
+        if len(batch.local_files) == len(batch.sample_dirs):
+            self._start_batch(batch)
+
+    def _start_batch(self, batch):
+        missing_jobs = []
+        for job in batch.jobs:
+            if batch.archive is not None:
+                # nothing to check in a new archive, only the member names
+                # taken by the batch
+                entries = batch.local_files.setdefault(job.sample_dir, {})
+                if job.path in batch.claimed_paths:
+                    state = self._resolve_duplicate(batch, job)
+                else:
+                    state = None
+                self._claim_path(batch, job, entries, state)
+
+                if state is None:
+                    missing_jobs.append(job)
+                else:
+                    self._finish_job(batch, job, state)
+                continue
+
+            entries = batch.local_files[job.sample_dir]
+            if entries is None:
+                # new directory, created once for all its files
+                try:
+                    self.create_sample_directory(job.sample_dir)
+                    batch.local_files[job.sample_dir] = {}
+                except OSError, e:
+                    batch.local_files[job.sample_dir] = e
+
+            entries = batch.local_files[job.sample_dir]
+            if isinstance(entries, Exception):
+                # only the files in this directory fail, they're left in
+                # the journal so they can be resumed
+                error_message = 'Error accessing sub-directory %s: %s' % (
+                    job.sample_dir,
+                    entries
+                )
+                if error_message not in batch.warnings:
+                    batch.warnings.append(error_message)
+                self._finish_job(batch, job, 'error')
+                continue
+
+            if job.path in batch.claimed_paths:
+                state = self._resolve_duplicate(batch, job)
+            else:
+                batch.claimed_paths.add(job.path)
+                state = self._check_existing_sample(batch, job)
+            self._claim_path(batch, job, entries, state)
+
+            if state is None:
+                missing_jobs.append(job)
+            elif state != 'verifying':
+                self._finish_job(batch, job, state)
+
+        for job in missing_jobs:
+            batch.add_pending(job)
+        if batch.smallest_first:
+            self.fetch_queued_job_sizes(batch)
+        self._schedule_downloads(batch)
+
+        # nothing may be left to transfer or verify
+        self._check_batch_finished(batch)
+
+    @staticmethod
+    def _claim_path(batch, job, entries, state):
+        # whatever became of the job, its (possibly renamed) path now
+        # belongs to it & a new file is reserved in the directory entries
+        # for the later jobs
+        batch.claimed_paths.add(job.path)
+        if state is None and job.file_name not in entries:
+            entries[job.file_name] = (True, None, None)
+
+    def _schedule_downloads(self, batch):
+        # hand jobs to the shared transfer pool as download slots for the
+        # host free up, so the pipe stays full for the whole batch. Original
+        # & clean files are scheduled independently so clean files are
+        # requested from the start instead of after the originals.
+        if batch.paused:
+            return
+
+        for version in batch.pending_jobs:
+            slot = (self.host, version)
+            slot_count = MAX_DOWNLOADS_PER_HOST[version]
+
+            while batch.host_downloads[slot] < slot_count:
+                job = batch.pop_pending(version)
+                if job is None:
+                    break
+
+                batch.host_downloads[slot] += 1
+                self._submit_download(batch, job)
+
+        self.queue_changed = True
+
+    def _submit_download(self, batch, job):
+        batch.active_jobs.append(job)
+        batch.journal.mark(job, 'started')
+        self.transfer_pool.submit(
+            self._download_sample,
+            (job, batch.archive),
+            callback=lambda result: self._finish_download(
+                batch,
+                job,
+                'downloaded'
+            ),
+            errback=lambda error: self._fail_download(batch, job, error)
         )
-        visit_chooser_label = Tkinter.Label(
-            visit_chooser_label_frame,
-            text='Visit:',
-            bg=BACKGROUND_COLOR,
-            width=LABEL_WIDTH,
-            anchor=Tkinter.E
+
+    def _finish_download(self, batch, job, state):
+        batch.active_jobs.remove(job)
+        batch.host_downloads[(self.host, job.version)] -= 1
+        self._finish_job(batch, job, state)
+        self._schedule_downloads(batch)
+
+    def _fail_download(self, batch, job, error):
+        if isinstance(error, DownloadCancelled):
+            self._finish_download(batch, job, 'cancelled')
+            return
+
+        batch.warnings.append('Download failed (%s): %s' % (error, job.path))
+        self._finish_download(batch, job, 'error')
+
+    def _finish_job(self, batch, job, state):
+        job.state = state
+        batch.journal.mark(job, state)
+        # only counted here, the progress bar is repainted at a fixed rate
+        # from poll_transfer_pool
+        batch.finished_count += 1
+
+        self._check_batch_finished(batch)
+
+    def _check_batch_finished(self, batch):
+        if not batch.is_finished or batch.is_closed:
+            return
+        batch.is_closed = True
+
+        batch.verifier.shutdown()
+
+        # files written by the batch are synced to disk together at the end
+        if batch.archive is not None:
+            batch.archive.close()
+            written_paths = [batch.archive.path]
+        else:
+            written_paths = [
+                job.path for job in batch.jobs if job.state == 'downloaded'
+            ]
+
+        # one bulk write describing every file now in place, if any
+        present_jobs = [
+            job for job in batch.jobs
+            if job.state in ['downloaded', 'exists']
+        ]
+        if batch.metadata_path is not None and present_jobs:
+            # noinspection PyBroadException
+            try:
+                write_sample_metadata(
+                    batch.metadata_path,
+                    present_jobs,
+                    written_paths
+                )
+            except Exception, e:
+                print e
+
+        # fingerprints of the clean files written are saved in one go
+        save_clean_fingerprints(
+            self.host,
+            dict(
+                [
+                    (os.path.abspath(job.path), job.fingerprint)
+                    for job in batch.jobs
+                    if job.state == 'downloaded'
+                    and job.fingerprint is not None
+                ]
+            )
         )
-        visit_chooser_label.pack(side='left')
-        visit_chooser_label_frame.pack(side='left', fill='x')
 
-        # visit chooser listbox frame
-        visit_chooser_frame = Tkinter.Frame(visit_frame, bg=BACKGROUND_COLOR)
-        self.visit_menu = Tkinter.OptionMenu(
-            visit_chooser_frame,
-            self.visit_selection,
-            ''
+        self.transfer_pool.submit(sync_files, (written_paths,))
+
+        if any(job.state == 'error' for job in batch.jobs):
+            # keep the journal so failed files can be retried
+            batch.journal.close()
+        else:
+            batch.journal.close(remove=True)
+
+        if self.download_batch is batch:
+            self.download_batch = None
+            self.queue_changed = True
+
+        self.measure_throughput(batch)
+
+        # show the final state right away
+        self.refresh_progress(batch)
+
+        if batch.warnings and batch.show_report:
+            self.show_batch_report(batch)
+        elif batch.warnings:
+            for warning in batch.warnings:
+                print warning
+
+        if batch.finish_callback is not None:
+            batch.finish_callback(batch)
+
+    def show_batch_report(self, batch):
+        # a window rather than a dialog, so nothing waits on the user
+        report_window = Tkinter.Toplevel(self.master)
+        report_window.title('Download Report')
+        report_window.config(bg=BACKGROUND_COLOR)
+
+        report_summary_label = Tkinter.Label(
+            report_window,
+            text='%d problem(s) in a batch of %d file(s):' % (
+                len(batch.warnings),
+                len(batch.jobs)
+            ),
+            bg=BACKGROUND_COLOR,
+            anchor=Tkinter.W
         )
-        self.visit_menu.config(bg=BACKGROUND_COLOR)
-        self.visit_menu.pack(fill='x', expand=True, side='left')
-        clear_visit_filter_button = ttk.Button(
-            visit_chooser_frame,
-            text='Clear',
-            command=self.clear_visit_filter
+        report_summary_label.pack(
+            fill='x',
+            padx=PAD_MEDIUM,
+            pady=PAD_MEDIUM
         )
-        clear_visit_filter_button.pack(side='left')
-        visit_chooser_frame.pack(fill='x', expand=True)
 
-        visit_frame.pack(
-            side='top',
-            fill='x',
+        report_frame = Tkinter.Frame(report_window, bg=BACKGROUND_COLOR)
+        report_scroll_bar = Tkinter.Scrollbar(report_frame, orient='vertical')
+        report_text = Tkinter.Text(
+            report_frame,
+            yscrollcommand=report_scroll_bar.set,
+            highlightthickness=0,
+            wrap='none',
+            width=100,
+            height=24
+        )
+        report_scroll_bar.config(command=report_text.yview)
+        report_scroll_bar.pack(side='right', fill='y')
+        report_text.pack(fill='both', expand=True)
+        report_frame.pack(
+            fill='both',
             expand=True,
             padx=PAD_MEDIUM,
-            pady=PAD_SMALL
+            pady=(0, PAD_MEDIUM)
         )
 
-        # overall panel_template frame
-        panel_template_frame = Tkinter.Frame(
-            metadata_frame,
-            bg=BACKGROUND_COLOR
-        )
+        report_text.insert(Tkinter.END, '\n'.join(batch.warnings))
+        report_text.config(state='disabled')
 
-        # panel_template label frame
-        panel_template_chooser_label_frame = Tkinter.Frame(
-            panel_template_frame,
-            bg=BACKGROUND_COLOR
-        )
-        panel_template_chooser_label = Tkinter.Label(
-            panel_template_chooser_label_frame,
-            text='Panel Template:',
-            bg=BACKGROUND_COLOR,
-            width=LABEL_WIDTH,
-            anchor=Tkinter.E
-        )
-        panel_template_chooser_label.pack(side='left')
-        panel_template_chooser_label_frame.pack(side='left', fill='x')
+    def measure_throughput(self, batch):
+        if batch.start_bytes_written is None:
+            return
 
-        # panel_template chooser listbox frame
-        panel_template_chooser_frame = Tkinter.Frame(
-            panel_template_frame,
-            bg=BACKGROUND_COLOR
-        )
-        self.panel_template_menu = Tkinter.OptionMenu(
-            panel_template_chooser_frame,
-            self.panel_template_selection,
-            ''
-        )
-        self.panel_template_menu.config(bg=BACKGROUND_COLOR)
-        self.panel_template_menu.pack(fill='x', expand=True, side='left')
-        clear_panel_template_filter_button = ttk.Button(
-            panel_template_chooser_frame,
-            text='Clear',
-            command=self.clear_panel_template_filter
+        elapsed = time.time() - batch.start_time
+        bytes_written = (
+            self.transfer_stats.bytes_written - batch.start_bytes_written
         )
-        clear_panel_template_filter_button.pack(side='left')
-        panel_template_chooser_frame.pack(fill='x', expand=True)
 
-        panel_template_frame.pack(
-            side='top',
-            fill='x',
-            expand=True,
-            padx=PAD_MEDIUM,
-            pady=PAD_SMALL
-        )
+        # tiny batches say more about latency than throughput
+        if elapsed < 1 or bytes_written < DOWNLOAD_CHUNK_SIZE:
+            return
 
-        # overall stimulation frame
-        stimulation_frame = Tkinter.Frame(
-            metadata_frame,
-            bg=BACKGROUND_COLOR
+        self.throughput = bytes_written / elapsed
+        save_user_settings(throughput=self.throughput)
+
+    def _collect_verified_samples(self, batch):
+        for job, sha1_digest in batch.verifier.finished():
+            # an unreadable existing file has no digest & is a mismatch
+            state = self._finish_existing_sample(batch, job, sha1_digest)
+            if state is None:
+                # replaced or renamed under the batch's conflict policy
+                batch.add_pending(job)
+                self._schedule_downloads(batch)
+            elif state != 'verifying':
+                # otherwise the next numbered copy is being checked
+                self._finish_job(batch, job, state)
+
+    def poll_transfer_pool(self):
+        # the poll is always re-armed, an error here would otherwise stop
+        # every result from reaching the Tk thread
+        # noinspection PyBroadException
+        try:
+            self._poll_transfer_pool()
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self.after(TRANSFER_POLL_INTERVAL, self.poll_transfer_pool)
+
+    def _poll_transfer_pool(self):
+        self.transfer_pool.poll()
+
+        if self.download_batch is not None:
+            self._collect_verified_samples(self.download_batch)
+
+            # workers & callbacks only update counters, the progress is
+            # repainted at a fixed rate however quickly files finish
+            refresh_time = self.progress_refresh_time
+            if time.time() - refresh_time > PROGRESS_REFRESH_INTERVAL:
+                self.refresh_progress(self.download_batch)
+
+        # the queue window is refreshed at a limited rate since a large
+        # queue is costly to redraw
+        if self.queue_changed and self.queue_listbox is not None:
+            if time.time() - self.queue_refresh_time > QUEUE_REFRESH_INTERVAL:
+                self.refresh_download_queue()
+
+    def refresh_progress(self, batch):
+        self.progress_refresh_time = time.time()
+
+        # widgets are only reconfigured when their content changed
+        if self.progress_drawn_count != batch.finished_count:
+            self.download_progress_bar.config(value=batch.finished_count)
+            self.progress_drawn_count = batch.finished_count
+
+        stats_text = self.transfer_stats.summary()
+        if self.transfer_stats_label.cget('text') != stats_text:
+            self.transfer_stats_label.config(text=stats_text)
+
+    def show_download_queue(self):
+        if self.queue_window is not None:
+            self.queue_window.lift()
+            return
+
+        self.queue_window = Tkinter.Toplevel(self.master)
+        self.queue_window.title('Download Queue')
+        self.queue_window.config(bg=BACKGROUND_COLOR)
+        self.queue_window.protocol(
+            'WM_DELETE_WINDOW',
+            self.close_download_queue
         )
 
-        # stimulation label frame
-        stimulation_chooser_label_frame = Tkinter.Frame(
-            stimulation_frame,
+        queue_button_frame = Tkinter.Frame(
+            self.queue_window,
             bg=BACKGROUND_COLOR
         )
-        stimulation_chooser_label = Tkinter.Label(
-            stimulation_chooser_label_frame,
-            text='Stimulation:',
-            bg=BACKGROUND_COLOR,
-            width=LABEL_WIDTH,
-            anchor=Tkinter.E
+        self.queue_pause_button = ttk.Button(
+            queue_button_frame,
+            text='Pause',
+            command=self.toggle_download_queue_paused
         )
-        stimulation_chooser_label.pack(side='left')
-        stimulation_chooser_label_frame.pack(side='left', fill='x')
-
-        # stimulation chooser listbox frame
-        stimulation_chooser_frame = Tkinter.Frame(
-            stimulation_frame,
-            bg=BACKGROUND_COLOR
+        self.queue_pause_button.pack(side='left')
+        pin_button = ttk.Button(
+            queue_button_frame,
+            text='Move to Top',
+            command=self.pin_queued_jobs
         )
-        self.stimulation_menu = Tkinter.OptionMenu(
-            stimulation_chooser_frame,
-            self.stimulation_selection,
-            ''
+        pin_button.pack(side='left', padx=(PAD_MEDIUM, 0))
+        cancel_button = ttk.Button(
+            queue_button_frame,
+            text='Cancel Selected',
+            command=self.cancel_queued_jobs
         )
-        self.stimulation_menu.config(bg=BACKGROUND_COLOR)
-        self.stimulation_menu.pack(fill='x', expand=True, side='left')
-        clear_stimulation_filter_button = ttk.Button(
-            stimulation_chooser_frame,
-            text='Clear',
-            command=self.clear_stimulation_filter
+        cancel_button.pack(side='left', padx=(PAD_MEDIUM, 0))
+        smallest_first_checkbutton = Tkinter.Checkbutton(
+            queue_button_frame,
+            text='Smallest First',
+            variable=self.queue_smallest_first,
+            command=self.toggle_download_queue_order,
+            bg=BACKGROUND_COLOR,
+            highlightthickness=0
         )
-        clear_stimulation_filter_button.pack(side='left')
-        stimulation_chooser_frame.pack(fill='x', expand=True)
-
-        stimulation_frame.pack(
-            side='top',
+        smallest_first_checkbutton.pack(side='left', padx=(PAD_MEDIUM, 0))
+        queue_button_frame.pack(
             fill='x',
-            expand=True,
             padx=PAD_MEDIUM,
-            pady=PAD_SMALL
+            pady=PAD_MEDIUM
         )
 
-        self.load_user_projects()
-
-        # start file chooser widgets
-        file_chooser_frame = Tkinter.Frame(
-            middle_right_frame,
+        queue_list_frame = Tkinter.Frame(
+            self.queue_window,
             bg=BACKGROUND_COLOR
         )
-
-        file_list_frame = Tkinter.Frame(
-            file_chooser_frame,
-            bg=BACKGROUND_COLOR,
-            highlightcolor=HIGHLIGHT_COLOR,
-            highlightbackground=BORDER_COLOR,
-            highlightthickness=1
-        )
-        file_scroll_bar = Tkinter.Scrollbar(
-            file_list_frame,
+        queue_scroll_bar = Tkinter.Scrollbar(
+            queue_list_frame,
             orient='vertical'
         )
-        self.file_list_canvas = Tkinter.Canvas(
-            file_list_frame,
-            yscrollcommand=file_scroll_bar.set,
-            relief='flat',
-            borderwidth=0,
-            bg=BACKGROUND_COLOR
-        )
-        self.file_list_canvas.bind('<MouseWheel>', self._on_mousewheel)
-
-        # for linux
-        self.file_list_canvas.bind(
-            '<Button-4>',
-            lambda event: self.file_list_canvas.yview_scroll(
-                -1,
-                'units'
-            )
-        )
-        self.file_list_canvas.bind(
-            '<Button-5>',
-            lambda event: self.file_list_canvas.yview_scroll(
-                1,
-                'units'
-            )
-        )
-
-        file_scroll_bar.config(command=self.file_list_canvas.yview)
-        file_scroll_bar.pack(side='right', fill='y')
-        self.file_list_canvas.pack(
-            fill='both',
-            expand=True
-        )
-        file_list_frame.pack(
-            fill='both',
-            expand=True,
-            pady=(PAD_LARGE, 0)
+        self.queue_listbox = Tkinter.Listbox(
+            queue_list_frame,
+            yscrollcommand=queue_scroll_bar.set,
+            selectmode='extended',
+            highlightthickness=0,
+            width=80,
+            height=24
         )
-        file_chooser_frame.pack(
+        queue_scroll_bar.config(command=self.queue_listbox.yview)
+        queue_scroll_bar.pack(side='right', fill='y')
+        self.queue_listbox.pack(fill='both', expand=True)
+        queue_list_frame.pack(
             fill='both',
             expand=True,
-            anchor='n'
+            padx=PAD_MEDIUM,
+            pady=(0, PAD_MEDIUM)
         )
 
-        # Progress bar
-        progress_frame = Tkinter.Frame(bottom_frame, bg=BACKGROUND_COLOR)
-        self.download_progress_bar = ttk.Progressbar(progress_frame)
-        self.download_progress_bar.pack(side='bottom', fill='x', expand=True)
-        progress_frame.pack(
-            fill='x',
-            expand=False,
-            anchor='s'
-        )
+        self.refresh_download_queue()
 
-    def _on_mousewheel(self, event):
-        self.file_list_canvas.yview_scroll(-event.delta, "units")
+    def close_download_queue(self):
+        self.queue_window.destroy()
+        self.queue_window = None
+        self.queue_listbox = None
+        self.queue_pause_button = None
 
-    def apply_filters(self):
-        project_name = self.project_selection.get()
-        if project_name in self.project_dict:
-            project_id = self.project_dict[project_name]
+    def refresh_download_queue(self):
+        self.queue_changed = False
+        self.queue_refresh_time = time.time()
+
+        batch = self.download_batch
+        if batch is None:
+            jobs = []
+            self.queue_pause_button.config(text='Pause')
         else:
-            # if we don't get a project ID then there's nothing to do but
-            # clear the canvas
-            self.file_list_canvas.delete(Tkinter.ALL)
+            jobs = batch.get_queued_jobs()
+            if batch.paused:
+                self.queue_pause_button.config(text='Resume')
+            else:
+                self.queue_pause_button.config(text='Pause')
+
+        self.queue_listbox_jobs = jobs
+        self.queue_listbox.delete(0, Tkinter.END)
+        for job in jobs:
+            if job in batch.active_jobs:
+                status = 'Downloading'
+            elif batch.paused:
+                status = 'Paused'
+            else:
+                status = 'Queued'
+            self.queue_listbox.insert(
+                Tkinter.END,
+                '%-12s %s (%s)' % (status, job.file_name, job.version)
+            )
+
+    def get_selected_queued_jobs(self):
+        return [
+            self.queue_listbox_jobs[int(i)]
+            for i in self.queue_listbox.curselection()
+        ]
+
+    def toggle_download_queue_paused(self):
+        batch = self.download_batch
+        if batch is None:
             return
 
-        site_name = self.site_selection.get()
-        if site_name in self.site_dict:
-            site_id = self.site_dict[site_name]
-        else:
-            site_id = None
+        batch.paused = not batch.paused
+        if not batch.paused:
+            self._schedule_downloads(batch)
+        self.refresh_download_queue()
 
-        subject_name = self.subject_selection.get()
-        if subject_name in self.subject_dict:
-            subject_id = self.subject_dict[subject_name]
-        else:
-            subject_id = None
+    def pin_queued_jobs(self):
+        batch = self.download_batch
+        if batch is None:
+            return
 
-        visit_name = self.visit_selection.get()
-        if visit_name in self.visit_dict:
-            visit_id = self.visit_dict[visit_name]
-        else:
-            visit_id = None
+        for job in self.get_selected_queued_jobs():
+            job.pinned = True
+        batch.reorder()
+        self.refresh_download_queue()
 
-        panel_template_name = self.panel_template_selection.get()
-        if panel_template_name in self.panel_template_dict:
-            panel_template_id = self.panel_template_dict[panel_template_name]
-        else:
-            panel_template_id = None
+    def cancel_queued_jobs(self):
+        batch = self.download_batch
+        if batch is None:
+            return
 
-        stimulation_name = self.stimulation_selection.get()
-        if stimulation_name in self.stimulation_dict:
-            stimulation_id = self.stimulation_dict[stimulation_name]
-        else:
-            stimulation_id = None
+        for job in self.get_selected_queued_jobs():
+            if job.cancel_event.is_set():
+                continue
 
-        samples = rest.get_samples(
-            self.host,
-            self.token,
-            project_pk=project_id,
-            site_pk=site_id,
-            subject_pk=subject_id,
-            visit_pk=visit_id,
-            project_panel_pk=panel_template_id,
-            stimulation_pk=stimulation_id
+            # a transfer in flight stops after its current chunk & is
+            # finished by its errback, a pending job is finished now
+            job.cancel_event.set()
+            if job not in batch.active_jobs:
+                self._finish_job(batch, job, 'cancelled')
+
+        self.refresh_download_queue()
+
+    def toggle_download_queue_order(self):
+        batch = self.download_batch
+        if batch is None:
+            return
+
+        batch.smallest_first = bool(self.queue_smallest_first.get())
+        batch.reorder()
+        self.refresh_download_queue()
+
+        if batch.smallest_first:
+            self.fetch_queued_job_sizes(batch)
+
+    def fetch_queued_job_sizes(self, batch):
+        # fetch the sizes of the pending files in the background, the
+        # queue is reordered as they arrive
+        sample_ids = list(
+            set(
+                [
+                    job.sample_metadata['id']
+                    for job in batch.get_queued_jobs()
+                    if job.expected_size is None
+                ]
+            )
         )
+        for i in range(0, len(sample_ids), QUEUE_SIZE_FETCH_COUNT):
+            self.transfer_pool.submit(
+                fetch_sample_sizes,
+                (
+                    self.host,
+                    self.token,
+                    sample_ids[i:i + QUEUE_SIZE_FETCH_COUNT]
+                ),
+                callback=lambda sizes: self.set_queued_job_sizes(batch, sizes),
+                # the downloads themselves come first
+                low_priority=True
+            )
 
-        if 'data' not in samples:
+    def set_queued_job_sizes(self, batch, sizes):
+        # clean files are ordered by the size of their original
+        for job in batch.jobs:
+            if job.sample_metadata['id'] in sizes:
+                job.expected_size = sizes[job.sample_metadata['id']]
+
+        batch.reorder()
+        self.queue_changed = True
+
+    def resume_interrupted_download(self):
+        host, jobs, fingerprints = DownloadJournal.load(download_journal_path)
+
+        # clean files written before the interruption are recognised later
+        # whether or not the rest of the batch is resumed
+        save_clean_fingerprints(host, fingerprints)
+
+        if not jobs:
+            DownloadJournal.discard(download_journal_path)
             return
-        else:
-            samples = samples['data']
 
-        # sort samples list by original filename
-        samples = sorted(samples, key=lambda k: k['original_filename'])
+        if host != self.host:
+            # journal belongs to another server, leave it for that server
+            return
+
+        resume = tkMessageBox.askyesno(
+            'Resume Download',
+            'A previous download was interrupted with %d file(s) '
+            'remaining. Resume downloading the remaining files?' % len(jobs)
+        )
+        if not resume:
+            DownloadJournal.discard(download_journal_path)
+            return
+
+        for job in jobs:
+            # a file from a transfer that was in flight when the batch was
+            # interrupted is our own partial write, remove it so it can be
+            # downloaded again
+            if job.state != 'started':
+                continue
+            for temp_path in AtomicFileWriter.find_temp_paths(job.path):
+                if os.path.isfile(temp_path):
+                    os.remove(temp_path)
+
+        self.download_jobs(jobs)
+
+    def get_filter_profile(self):
+        profile = {
+            'host': self.host,
+            'selections': {},
+            'filters': {},
+            'download_parent_dir': self.download_parent_dir.get(),
+            'download_structure': self.download_structure.get(),
+            'download_version': self.download_version.get(),
+            'conflict_policy': self.conflict_policy.get()
+        }
+
+        # names are kept to restore the menus, the pks to query samples
+        for selection_name, dict_name, filter_name in FILTER_PROFILE_FIELDS:
+            value = getattr(self, selection_name).get()
+            profile['selections'][selection_name] = value
+            profile['filters'][filter_name] = getattr(self, dict_name).get(
+                value
+            )
+
+        return profile
+
+    def save_filter_profile(self):
+        if self.get_selected_project_id() is None:
+            tkMessageBox.showwarning(
+                'No Project Selected',
+                'Please choose a project before saving a filter profile.'
+            )
+            return
+
+        name = tkSimpleDialog.askstring(
+            'Save Filter Profile',
+            'Profile name:',
+            parent=self.master
+        )
+        if not name:
+            return
+
+        self.filter_profiles[name] = self.get_filter_profile()
+        save_json_file(filter_profiles_path, self.filter_profiles)
+        self.populate_profile_menu()
+
+    def delete_filter_profile(self, name):
+        self.filter_profiles.pop(name, None)
+        save_json_file(filter_profiles_path, self.filter_profiles)
 
-        # clear the canvas
-        self.file_list_canvas.delete(Tkinter.ALL)
+        profile_samples = load_json_file(profile_samples_path)
+        profile_samples.pop(name, None)
+        save_json_file(profile_samples_path, profile_samples)
 
-        # but delete seems to just remove the objects displayed, our
-        # check box instances remain, so we need to destroy them
-        for key, cb in self.file_list_canvas.children.items():
-            cb.destroy()
+        self.watched_profiles.discard(name)
+        save_user_settings(watched_profiles=sorted(self.watched_profiles))
 
-        for i, s in enumerate(samples):
-            cb = MyCheckbutton(
-                s,
-                self.file_list_canvas,
-                text=os.path.basename(s['original_filename'])
-            )
+        watch_state = load_json_file(watch_state_path)
+        watch_state.pop(name, None)
+        save_json_file(watch_state_path, watch_state)
 
-            # bind to our canvas mouse function
-            # to keep scrolling working when the mouse is over a checkbox
-            cb.bind('<MouseWheel>', self._on_mousewheel)
+        self.populate_profile_menu()
 
-            # for linux
-            cb.bind(
-                '<Button-4>',
-                lambda event: self.file_list_canvas.yview_scroll(
-                    -1,
-                    'units'
-                )
+    def populate_profile_menu(self):
+        self.profile_menu.delete(0, 'end')
+        self.profile_menu.add_command(
+            label='Save Current Filters...',
+            command=self.save_filter_profile
+        )
+
+        apply_menu = Tkinter.Menu(self.profile_menu, tearoff=0)
+        watch_menu = Tkinter.Menu(self.profile_menu, tearoff=0)
+        delete_menu = Tkinter.Menu(self.profile_menu, tearoff=0)
+        self.watch_profile_vars = {}
+        for name in sorted(self.filter_profiles.keys()):
+            apply_menu.add_command(
+                label=name,
+                command=lambda value=name: self.apply_filter_profile(value)
             )
-            cb.bind(
-                '<Button-5>',
-                lambda event: self.file_list_canvas.yview_scroll(
-                    1,
-                    'units'
-                )
+            self.watch_profile_vars[name] = Tkinter.IntVar()
+            self.watch_profile_vars[name].set(name in self.watched_profiles)
+            watch_menu.add_checkbutton(
+                label=name,
+                variable=self.watch_profile_vars[name],
+                command=lambda value=name: self.toggle_watched_profile(value)
             )
-
-            self.file_list_canvas.create_window(
-                PAD_MEDIUM,
-                PAD_LARGE + (24 * i),
-                anchor='nw',
-                window=cb
+            delete_menu.add_command(
+                label=name,
+                command=lambda value=name: self.delete_filter_profile(value)
             )
 
-        # update scroll region
-        self.file_list_canvas.config(
-            scrollregion=(0, 0, 1000, 10 + len(samples) * 24)
+        if self.filter_profiles:
+            state = 'normal'
+        else:
+            state = 'disabled'
+
+        self.profile_menu.add_cascade(
+            label='Apply Profile',
+            menu=apply_menu,
+            state=state
+        )
+        self.profile_menu.add_separator()
+        self.profile_menu.add_cascade(
+            label='Watch for New Samples',
+            menu=watch_menu,
+            state=state
+        )
+        self.profile_menu.add_cascade(
+            label='Delete Profile',
+            menu=delete_menu,
+            state=state
         )
 
-    def clear_project_filter(self):
-        # clearing project filter clears all other filters
-        self.project_selection.set('')
-        self.site_selection.set('')
-        self.subject_selection.set('')
-        self.visit_selection.set('')
-        self.panel_template_selection.set('')
-        self.stimulation_selection.set('')
+    def apply_filter_profile(self, name):
+        profile = self.filter_profiles[name]
 
-        # re-apply filter
-        self.apply_filters()
+        project_id = profile['filters']['project_pk']
+        project_names = [
+            project_name
+            for project_name, pk in self.project_dict.items()
+            if pk == project_id
+        ]
+        if profile['host'] != self.host or not project_names:
+            tkMessageBox.showwarning(
+                'Project Not Available',
+                'The project saved in profile %s is not available.' % name
+            )
+            return
 
-    def clear_site_filter(self):
-        self.site_selection.set('')
+        self.download_parent_dir.set(profile['download_parent_dir'])
+        self.download_structure.set(profile['download_structure'])
+        self.download_version.set(profile['download_version'])
+        self.conflict_policy.set(profile.get('conflict_policy', 'skip'))
+
+        # choosing the project reloads the other menus, their values are
+        # restored by pk as each one is populated
+        self.project_selection.set(project_names[0])
+        for selection_name, dict_name, filter_name in FILTER_PROFILE_FIELDS:
+            pk = profile['filters'][filter_name]
+            if selection_name != 'project_selection' and pk is not None:
+                self.profile_selections[selection_name] = pk
+
+        # show the last result set right away & refresh it in the
+        # background
+        profile_samples = load_json_file(profile_samples_path)
+        if name in profile_samples:
+            self.load_samples({'data': profile_samples[name]})
+
+        if self.profile_query is not None:
+            self.profile_query.cancel()
+
+        filters = dict(
+            (str(filter_name), pk)
+            for filter_name, pk in profile['filters'].items()
+        )
+        self.profile_query_name = name
+        self.profile_query = self.transfer_pool.submit(
+            rest.get_samples,
+            (self.host, self.token),
+            filters,
+            callback=lambda response: self.cache_profile_samples(
+                name,
+                response
+            )
+        )
 
-        # re-apply filter
-        self.apply_filters()
+    def cache_profile_samples(self, name, response):
+        self.profile_query = None
 
-    def clear_subject_filter(self):
-        self.subject_selection.set('')
+        if 'data' not in response:
+            return
 
-        # re-apply filter
-        self.apply_filters()
+        profile_samples = load_json_file(profile_samples_path)
+        profile_samples[name] = response['data']
+        save_json_file(profile_samples_path, profile_samples)
 
-    def clear_visit_filter(self):
-        self.visit_selection.set('')
+        # unless the filters were changed in the meantime
+        if self.profile_query_name == name:
+            self.load_samples(response)
 
-        # re-apply filter
-        self.apply_filters()
+    def restore_profile_selection(self, selection_name, choice_dict):
+        if selection_name not in self.profile_selections:
+            return
 
-    def clear_panel_template_filter(self):
-        self.panel_template_selection.set('')
+        pk = self.profile_selections.pop(selection_name)
+        for choice_name, choice_pk in choice_dict.items():
+            if choice_pk == pk:
+                getattr(self, selection_name).set(choice_name)
+
+        if not self.profile_selections:
+            self.schedule_apply_filters()
+
+    def toggle_watched_profile(self, name):
+        if self.watch_profile_vars[name].get():
+            # a profile may already match a whole project
+            download_existing = tkMessageBox.askyesno(
+                'Watch Profile',
+                'Also download the samples already matching profile %s?\n\n'
+                'Choose No to only download samples added from now on.'
+                % name
+            )
+            if not download_existing:
+                self.seeding_profiles.add(name)
+            self.watched_profiles.add(name)
+            self.poll_watched_profile(name)
+        else:
+            self.watched_profiles.discard(name)
+            self.seeding_profiles.discard(name)
 
-        # re-apply filter
-        self.apply_filters()
+        save_user_settings(watched_profiles=sorted(self.watched_profiles))
 
-    def clear_stimulation_filter(self):
-        self.stimulation_selection.set('')
+    def poll_watched_profiles(self):
+        if self.watch_after_id is not None:
+            self.after_cancel(self.watch_after_id)
 
-        # re-apply filter
-        self.apply_filters()
+        for name in sorted(self.watched_profiles):
+            self.poll_watched_profile(name)
 
-    def select_all_files(self):
-        for k, v in self.file_list_canvas.children.items():
-            if isinstance(v, MyCheckbutton):
-                v.mark_checked()
+        self.watch_after_id = self.after(
+            WATCH_POLL_INTERVAL,
+            self.poll_watched_profiles
+        )
 
-    def clear_all_files(self):
-        for k, v in self.file_list_canvas.children.items():
-            if isinstance(v, MyCheckbutton):
-                v.mark_unchecked()
+    def poll_watched_profile(self, name):
+        profile = self.filter_profiles.get(name)
+        if profile is None or profile['host'] != self.host:
+            return
 
-    def choose_download_parent_dir(self):
-        chosen_dir = tkFileDialog.askdirectory(
-            initialdir=self.download_parent_dir.get()
+        # the server returns only the samples matching the profile, those
+        # already fetched are skipped locally
+        filters = dict(
+            (str(filter_name), pk)
+            for filter_name, pk in profile['filters'].items()
+        )
+        self.transfer_pool.submit(
+            rest.get_samples,
+            (self.host, self.token),
+            filters,
+            callback=lambda response: self.download_watched_samples(
+                name,
+                response
+            )
         )
-        if not os.access(chosen_dir, os.EX_OK):
-            return
-        self.download_parent_dir.set(chosen_dir)
 
-    @staticmethod
-    def create_sample_directory(
-            parent_dir,
-            sample_metadata,
-            download_structure
-    ):
-        dir_list = [parent_dir]
+    def seed_watched_samples(self, name, response):
+        self.seeding_profiles.discard(name)
 
-        if download_structure == 'flat':
-            pass
-        elif download_structure == 'nested_psv':
-            dir_list.extend(
-                [
-                    sample_metadata['project_name'],
-                    sample_metadata['site_name'],
-                    sample_metadata['visit_name']
-                ]
-            )
-        elif download_structure == 'nested_pvs':
-            dir_list.extend(
-                [
-                    sample_metadata['project_name'],
-                    sample_metadata['visit_name'],
-                    sample_metadata['site_name']
-                ]
-            )
+        watch_state = load_json_file(watch_state_path)
+        fetched_ids = set(watch_state.get(name, []))
+        fetched_ids.update(sample['id'] for sample in response['data'])
+        watch_state[name] = sorted(fetched_ids)
+        save_json_file(watch_state_path, watch_state)
 
-        dir_path = "/".join(dir_list)
+    def download_watched_samples(self, name, response):
+        if 'data' not in response:
+            return
 
-        if not os.path.exists(dir_path):
-            os.makedirs(dir_path)
+        if name in self.seeding_profiles:
+            # the samples matching when the profile was first watched
+            # aren't downloaded, a failed poll seeds on the next one
+            self.seed_watched_samples(name, response)
+            return
 
-        return dir_path
+        profile = self.filter_profiles.get(name)
+        if profile is None or name not in self.watched_profiles:
+            # profile changed while it was polled
+            return
 
-    def _download_sample(self, sample_cb, sample_dir, clean=False):
-        # check if sample exists in path & if it's hash matches
-        # first, use lexists to avoid clobbering any file/dir/link
-        # that may exist, we don't want to mess with anything
-        # on the user's system
-        if clean:
-            pattern = re.compile(r'\.fcs$')
-            orig_file_name = sample_cb.sample_metadata['original_filename']
-            match = pattern.search(orig_file_name.lower())
-
-            if match is not None:
-                file_name = "_".join(
-                    [orig_file_name[0:match.start()], 'clean.fcs']
-                )
-            else:
-                file_name = "_".join([orig_file_name, 'clean.fcs'])
-        else:
-            file_name = sample_cb.sample_metadata['original_filename']
+        fetched_ids = set(load_json_file(watch_state_path).get(name, []))
+        samples = [
+            sample for sample in response['data']
+            if sample['id'] not in fetched_ids
+        ]
+        if not samples:
+            return
 
-        sample_path = "/".join([sample_dir, file_name])
+        if self.download_batch is not None:
+            # the new samples are picked up by the next poll
+            return
 
-        if os.path.lexists(sample_path):
-            # check SHA checksum for original file (can't do this for
-            # clean file as the server doesn't have the SHA checksum...the
-            # clean files are generated on the fly
-            if clean:
-                # warn user file exists & stop downloading
-                tkMessageBox.showwarning(
-                    'Clean File Exists',
-                    'Clean file already exists. The existing file '
-                    'will have to be deleted in order to re-download '
-                    'this file.\n%s' % sample_path
-                )
-                return
+        parent_dir = profile['download_parent_dir']
+        if not os.access(parent_dir, os.W_OK):
+            print 'Cannot write to %s for profile %s' % (parent_dir, name)
+            return
 
-            # now check if existing original file is identical
-            sample_file = open(sample_path)
-            sha1_hash = hashlib.sha1(sample_file.read())
-            sample_file.close()
+        jobs = self.get_download_jobs(
+            samples,
+            parent_dir,
+            profile['download_structure'],
+            profile['download_version'],
+            'folder'
+        )
 
-            if sha1_hash.hexdigest() == sample_cb.sample_metadata['sha1']:
-                # don't re-download if identical
-                return
-            else:
-                # warn user file exists & stop downloading
-                tkMessageBox.showwarning(
-                    'File Exists',
-                    'File already exists but does not match the '
-                    'file on the ReFlow server. The existing file '
-                    'will have to be deleted in order to download '
-                    'this file.\n%s' % sample_path
+        # sized in the background like any other download
+        self.transfer_pool.submit(
+            plan_download,
+            (self.host, self.token, jobs, True),
+            callback=lambda transfer_plan: self.start_watched_download(
+                name,
+                profile,
+                jobs,
+                transfer_plan
+            )
+        )
+
+    def start_watched_download(self, name, profile, jobs, transfer_plan):
+        if self.download_batch is not None:
+            # the new samples are picked up by the next poll
+            return
+        if name not in self.watched_profiles:
+            # no longer watched while it was sized
+            return
+
+        parent_dir = profile['download_parent_dir']
+        transfer_jobs, expected_bytes = transfer_plan
+        try:
+            free_bytes = get_free_space(parent_dir)
+        except (OSError, AttributeError):
+            free_bytes = None
+
+        # there's no one to ask, a download that would nearly fill the
+        # disk is held back
+        if expected_bytes is not None and free_bytes is not None:
+            if expected_bytes > free_bytes * PREFLIGHT_FREE_SPACE_RATIO:
+                print 'Not enough free space in %s for profile %s' % (
+                    parent_dir,
+                    name
                 )
                 return
 
-        # use ReFlow REST API to download sample
-        if clean:
-            rest.download_clean_sample(
-                self.host,
-                self.token,
-                sample_cb.sample_metadata['id'],
-                filename=file_name,
-                directory=sample_dir
-            )
-        else:
-            rest.download_sample(
-                self.host,
-                self.token,
-                sample_cb.sample_metadata['id'],
-                filename=file_name,
-                directory=sample_dir
+        metadata_path = "/".join([parent_dir, get_batch_name() + '_metadata'])
+        self.download_jobs(
+            jobs,
+            metadata_path=metadata_path,
+            finish_callback=lambda batch: self.record_watched_samples(
+                name,
+                batch
+            ),
+            # unattended batches follow the profile, not whatever policy is
+            # chosen in the window at the time
+            conflict_policy=profile.get('conflict_policy', 'skip'),
+            # unattended batches log their problems instead of opening a
+            # report window every poll
+            show_report=False
+        )
+
+    @staticmethod
+    def record_watched_samples(name, batch):
+        # a sample is recorded once all its files are handled, conflicts
+        # were settled by the conflict policy & cancelled files by the
+        # user. A sample with a failed file is tried again on the next
+        # poll.
+        sample_states = collections.defaultdict(list)
+        for job in batch.jobs:
+            sample_states[job.sample_metadata['id']].append(job.state)
+
+        watch_state = load_json_file(watch_state_path)
+        fetched_ids = set(watch_state.get(name, []))
+        fetched_ids.update(
+            sample_id for sample_id, states in sample_states.items()
+            if all(
+                state in ['downloaded', 'exists', 'conflict', 'cancelled']
+                for state in states
             )
+        )
+        watch_state[name] = sorted(fetched_ids)
+        save_json_file(watch_state_path, watch_state)
 
-    def download_selected(self):
-        parent_dir = self.download_parent_dir.get()
-        download_structure = self.download_structure.get()
-        download_version = self.download_version.get()
+    def load_user_projects(self):
+        self.transfer_pool.submit(
+            rest.get_projects,
+            (self.host, self.token),
+            callback=self.check_user_projects,
+            errback=self.fail_user_projects
+        )
 
-        # make sure we have write permissions for parent directory
-        if not os.access(parent_dir, os.W_OK):
-            tkMessageBox.showwarning(
-                'Insufficient Permissions',
-                'You do not have permission to write to %s' % parent_dir
-            )
+    def check_user_projects(self, response):
+        if response.get('status') in [401, 403]:
+            self.reauthenticate()
             return
 
-        # determine download count to setup progress bar
-        download_count = 0
-        for k, v in self.file_list_canvas.children.items():
-            if isinstance(v, MyCheckbutton):
-                if v.is_checked():
-                    download_count += 1
+        if 'data' in response:
+            # kept to show right away at the next launch with a saved token
+            self.cached_projects = [
+                {'project_name': result['project_name'], 'id': result['id']}
+                for result in response['data']
+            ]
+            save_user_settings(projects=self.cached_projects)
 
-        self.download_progress_bar.config(maximum=download_count)
+        self.populate_project_menu(response)
 
-        for k, v in self.file_list_canvas.children.items():
-            if isinstance(v, MyCheckbutton):
-                if v.is_checked():
-                    try:
-                        sample_dir = self.create_sample_directory(
-                            parent_dir,
-                            v.sample_metadata,
-                            download_structure
-                        )
-                    except OSError:
-                        tkMessageBox.showwarning(
-                            'Error creating sub-directory',
-                            'Do have permission to write to %s' % parent_dir
-                        )
-                        return
-
-                    if download_version in ['both', 'original']:
-                        # download original file
-                        self._download_sample(v, sample_dir)
-                    if download_version in ['both', 'clean']:
-                        # download clean file
-                        self._download_sample(v, sample_dir, clean=True)
-
-                    # update progress bar
-                    self.download_progress_bar.step()
-                    self.download_progress_bar.update()
+    def fail_user_projects(self, error):
+        response = getattr(error, 'response', None)
+        if getattr(response, 'status_code', None) in [401, 403]:
+            self.reauthenticate()
+            return
 
-    def load_user_projects(self):
-        try:
-            response = rest.get_projects(self.host, self.token)
-        except Exception, e:
-            print e
+        print error
+
+    def reauthenticate(self):
+        # the server rejected the token, only now is the password needed
+        if self.token is None:
             return
 
+        discard_cached_token(self.host, self.username)
+        self.token = None
+
+        tkMessageBox.showinfo(
+            'Login Expired',
+            'Your saved login is no longer valid, please log in again.'
+        )
+
+        self.main_frame_pack_info = self.main_frame.pack_info()
+        self.main_frame.pack_forget()
+        self.login_frame = Tkinter.Frame(bg=BACKGROUND_COLOR)
+        self.load_login_frame()
+
+    def forget_saved_login(self):
+        discard_cached_token(self.host, self.username)
+        self.remember_login.set(0)
+        save_user_settings(remember_login=0)
+
+    def populate_project_menu(self, response):
         if 'data' not in response:
             return
 
         self.project_menu['menu'].delete(0, 'end')
-        self.site_menu['menu'].delete(0, 'end')
-        self.subject_menu['menu'].delete(0, 'end')
-        self.visit_menu['menu'].delete(0, 'end')
-        self.stimulation_menu['menu'].delete(0, 'end')
-        self.panel_template_menu['menu'].delete(0, 'end')
+        self.site_menu.set_choices([])
+        self.subject_menu.set_choices([])
+        self.visit_menu.set_choices([])
+        self.stimulation_menu.set_choices([])
+        self.panel_template_menu.set_choices([])
 
         for result in response['data']:
             self.project_dict[result['project_name']] = result['id']
@@ -1269,153 +5228,161 @@ class Application(Tkinter.Frame):
                 self.project_selection.set(value)
             )
 
+    def get_selected_project_id(self):
+        return self.project_dict.get(self.project_selection.get())
+
+    def load_project_metadata(
+            self,
+            rest_function,
+            project_id,
+            populate,
+            selection_name
+    ):
+        # fetch a project's metadata in the background, the response is
+        # dropped if another project was selected in the meantime
+        def callback(response):
+            if project_id != self.get_selected_project_id():
+                return
+            if 'data' not in response:
+                errback(None)
+                return
+            populate(response['data'])
+
+        # noinspection PyUnusedLocal
+        def errback(error):
+            # a menu that can't be loaded can't be restored from a profile
+            # either, don't let it hold up the filters
+            self.restore_profile_selection(selection_name, {})
+
+        self.transfer_pool.submit(
+            rest_function,
+            (self.host, self.token),
+            {'project_pk': project_id},
+            callback=callback,
+            errback=errback
+        )
+
     def load_project_sites(self, project_id):
-        self.site_menu['menu'].delete(0, 'end')
+        self.site_menu.set_choices([])
         self.site_selection.set('')
         self.site_dict.clear()
 
-        response = None
-        try:
-            response = rest.get_sites(
-                self.host,
-                self.token,
-                project_pk=project_id
-            )
-        except Exception, e:
-            print e
-
-        if 'data' not in response:
-            return
+        self.load_project_metadata(
+            rest.get_sites,
+            project_id,
+            self.populate_site_menu,
+            'site_selection'
+        )
 
-        for result in response['data']:
+    def populate_site_menu(self, results):
+        for result in results:
             self.site_dict[result['site_name']] = result['id']
-        for site_name in sorted(self.site_dict.keys()):
-            self.site_menu['menu'].add_command(
-                label=site_name,
-                command=lambda value=site_name:
-                self.site_selection.set(value)
-            )
+        self.site_menu.set_choices(self.site_dict.keys())
+
+        self.restore_profile_selection('site_selection', self.site_dict)
 
     def load_project_subjects(self, project_id):
-        self.subject_menu['menu'].delete(0, 'end')
+        self.subject_menu.set_choices([])
         self.subject_selection.set('')
         self.subject_dict.clear()
 
-        response = None
-        try:
-            response = rest.get_subjects(
-                self.host,
-                self.token,
-                project_pk=project_id
-            )
-        except Exception, e:
-            print e
-
-        if 'data' not in response:
-            return
+        self.load_project_metadata(
+            rest.get_subjects,
+            project_id,
+            self.populate_subject_menu,
+            'subject_selection'
+        )
 
-        for result in response['data']:
+    def populate_subject_menu(self, results):
+        for result in results:
             self.subject_dict[result['subject_code']] = result['id']
-        for subject_code in sorted(self.subject_dict.keys()):
-            self.subject_menu['menu'].add_command(
-                label=subject_code,
-                command=lambda value=subject_code:
-                self.subject_selection.set(value)
-            )
+        self.subject_menu.set_choices(self.subject_dict.keys())
+
+        self.restore_profile_selection('subject_selection', self.subject_dict)
 
     def load_project_visits(self, project_id):
-        self.visit_menu['menu'].delete(0, 'end')
+        self.visit_menu.set_choices([])
         self.visit_selection.set('')
         self.visit_dict.clear()
 
-        response = None
-        try:
-            response = rest.get_visit_types(
-                self.host,
-                self.token,
-                project_pk=project_id
-            )
-        except Exception, e:
-            print e
-
-        if 'data' not in response:
-            return
+        self.load_project_metadata(
+            rest.get_visit_types,
+            project_id,
+            self.populate_visit_menu,
+            'visit_selection'
+        )
 
-        for result in response['data']:
+    def populate_visit_menu(self, results):
+        for result in results:
             self.visit_dict[result['visit_type_name']] = result['id']
-        for visit_type_name in sorted(self.visit_dict.keys()):
-            self.visit_menu['menu'].add_command(
-                label=visit_type_name,
-                command=lambda value=visit_type_name:
-                self.visit_selection.set(value)
-            )
+        self.visit_menu.set_choices(self.visit_dict.keys())
+
+        self.restore_profile_selection('visit_selection', self.visit_dict)
 
     def load_project_stimulations(self, project_id):
-        self.stimulation_menu['menu'].delete(0, 'end')
+        self.stimulation_menu.set_choices([])
         self.stimulation_selection.set('')
         self.stimulation_dict.clear()
 
-        try:
-            response = rest.get_stimulations(
-                self.host,
-                self.token,
-                project_pk=project_id
-            )
-        except Exception, e:
-            print e
-            return
-
-        if 'data' not in response:
-            return
+        self.load_project_metadata(
+            rest.get_stimulations,
+            project_id,
+            self.populate_stimulation_menu,
+            'stimulation_selection'
+        )
 
-        for result in response['data']:
+    def populate_stimulation_menu(self, results):
+        for result in results:
             self.stimulation_dict[result['stimulation_name']] = result['id']
-        for stimulation in sorted(self.stimulation_dict.keys()):
-            self.stimulation_menu['menu'].add_command(
-                label=stimulation,
-                command=lambda value=stimulation:
-                self.stimulation_selection.set(value)
-            )
+        self.stimulation_menu.set_choices(self.stimulation_dict.keys())
+
+        self.restore_profile_selection(
+            'stimulation_selection',
+            self.stimulation_dict
+        )
 
     def load_project_panel_templates(self, project_id):
-        self.panel_template_menu['menu'].delete(0, 'end')
+        self.panel_template_menu.set_choices([])
         self.panel_template_selection.set('')
         self.panel_template_dict.clear()
 
-        response = None
-        try:
-            response = rest.get_project_panels(
-                self.host,
-                self.token,
-                project_pk=project_id
-            )
-        except Exception, e:
-            print e
-
-        if 'data' not in response:
-            return
+        self.load_project_metadata(
+            rest.get_project_panels,
+            project_id,
+            self.populate_panel_template_menu,
+            'panel_template_selection'
+        )
 
-        for result in response['data']:
+    def populate_panel_template_menu(self, results):
+        for result in results:
             self.panel_template_dict[result['panel_name']] = result['id']
-        for panel_name in sorted(self.panel_template_dict.keys()):
-            self.panel_template_menu['menu'].add_command(
-                label=panel_name,
-                command=lambda value=panel_name:
-                self.panel_template_selection.set(value)
-            )
+        self.panel_template_menu.set_choices(self.panel_template_dict.keys())
+
+        self.restore_profile_selection(
+            'panel_template_selection',
+            self.panel_template_dict
+        )
 
     def update_metadata(*args):
         self = args[0]
 
         option_value = self.project_selection.get()
 
+        # choosing another project drops the rest of an applied profile
+        self.profile_selections.clear()
+
         if option_value in self.project_dict:
+            # start fetching the sample list while the menus load
+            self.prefetch_project_samples(self.project_dict[option_value])
+
             self.load_project_sites(self.project_dict[option_value])
             self.load_project_subjects(self.project_dict[option_value])
             self.load_project_visits(self.project_dict[option_value])
             self.load_project_panel_templates(self.project_dict[option_value])
             self.load_project_stimulations(self.project_dict[option_value])
 
-root = Tkinter.Tk()
-app = Application(root)
-app.mainloop()
+
+if __name__ == '__main__':
+    root = Tkinter.Tk()
+    app = Application(root)
+    app.mainloop()
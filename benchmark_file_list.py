@@ -0,0 +1,143 @@
+"""
+Benchmarks the sample file list against synthetic projects of increasing
+size, reporting wall time, peak memory & widget counts for filtering,
+selecting, clearing & scrolling the list.
+
+Needs a display, on a headless machine run it under a virtual one:
+
+    xvfb-run python benchmark_file_list.py [size ...]
+"""
+import os
+import sys
+import time
+import resource
+import tempfile
+
+# keep the benchmark away from the user's settings, journal & caches,
+# the client reads these paths when it's imported
+os.environ['HOME'] = tempfile.mkdtemp(prefix='reflow_benchmark_')
+
+# the client loads its images relative to its own directory
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+import Tkinter
+import ReFlowDownloadClient
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+# number of page scrolls when scrolling through the list
+SCROLL_STEPS = 50
+
+BENCHMARK_PROJECT_NAME = 'Benchmark Project'
+BENCHMARK_PROJECT_ID = 1
+
+
+class BenchmarkApplication(ReFlowDownloadClient.Application):
+    """
+    The client with its server & session requests disabled, the file list
+    is driven from synthetic sample lists instead.
+    """
+    def update_metadata(*args):
+        pass
+
+    def load_user_projects(self):
+        pass
+
+    def resume_interrupted_download(self):
+        pass
+
+    def poll_watched_profiles(self):
+        pass
+
+
+def make_samples(count):
+    samples = []
+    for i in range(count):
+        samples.append(
+            {
+                'id': i + 1,
+                'original_filename': 'sample_%06d.fcs' % i,
+                'project_name': BENCHMARK_PROJECT_NAME,
+                'site_name': 'Site %d' % (i % 10),
+                'subject_code': 'S%05d' % (i % 5000),
+                'visit_name': 'Visit %d' % (i % 4),
+                'panel_name': 'Panel %d' % (i % 8),
+                'stimulation_name': 'Stimulation %d' % (i % 3),
+                'sha1': '%040x' % i
+            }
+        )
+
+    return samples
+
+
+def get_peak_memory():
+    # ru_maxrss is in kilobytes on Linux, bytes on OS X
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak_memory / 1024
+    return peak_memory
+
+
+def count_widgets(widget):
+    return 1 + sum(
+        count_widgets(child) for child in widget.winfo_children()
+    )
+
+
+def measure(app, name, operation):
+    start_time = time.time()
+    operation()
+    # include the redraw in the timing
+    app.update()
+    elapsed = time.time() - start_time
+
+    print '  %-16s %8.3f s  %10d KB peak  %8d widgets' % (
+        name,
+        elapsed,
+        get_peak_memory(),
+        count_widgets(app.master)
+    )
+
+
+def scroll_list(app):
+    app.file_list_canvas.yview_moveto(0)
+    for i in range(SCROLL_STEPS):
+        app.file_list_canvas.yview_scroll(1, 'pages')
+        app.update_idletasks()
+
+
+def run_benchmark(app, size):
+    print '%d samples' % size
+
+    app.project_samples[BENCHMARK_PROJECT_ID] = make_samples(size)
+    app.project_selection.set(BENCHMARK_PROJECT_NAME)
+
+    measure(app, 'apply_filters', app.apply_filters)
+    measure(app, 'select_all_files', app.select_all_files)
+    measure(app, 'clear_all_files', app.clear_all_files)
+    measure(app, 'scroll', lambda: scroll_list(app))
+
+    # start the next size from an empty list
+    app.project_samples.clear()
+    app.load_samples({'data': []})
+    app.update()
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or DEFAULT_SIZES
+
+    root = Tkinter.Tk()
+    app = BenchmarkApplication(root)
+    app.login_frame.destroy()
+    app.load_main_frame()
+    app.project_dict[BENCHMARK_PROJECT_NAME] = BENCHMARK_PROJECT_ID
+    app.update()
+
+    for size in sizes:
+        run_benchmark(app, size)
+
+    root.destroy()
+
+
+if __name__ == '__main__':
+    main()